@@ -5,23 +5,60 @@ __email__ = 'a@shepetko.com'
 __license__ = 'MIT'
 
 # Public API
-from . import _widget as widget, _forms as forms, _model as model
-from ._api import get_browser, get_m_form, get_d_form, get_model_class, dispense_entity
+from . import _widget as widget, _forms as forms, _model as model, _broker as broker, \
+    _aio as aio
+from ._api import get_browser, get_m_form, get_d_form, get_model_class, dispense_entity, \
+    get_mock
 from ._browser import Browser
+from ._collation import register_collator, sort_entities
+from ._field_widgets import register as register_field_widget
 from ._model import UIEntity
 
 
+def plugin_load():
+    from pytsite import events
+    from . import _changes
+
+    events.listen('odm@entity.save', _changes.on_entity_save)
+    events.listen('odm@entity.delete', _changes.on_entity_delete)
+
+
+def plugin_load_console():
+    from pytsite import console
+    from . import _bench, _indexes
+
+    console.register_command(_bench.Bench())
+    console.register_command(_indexes.Indexes())
+
+
 def plugin_load_wsgi():
     from pytsite import router
     from plugins import admin, http_api, auth_ui
-    from . import _controllers, _http_api_controllers
+    from . import _controllers, _http_api_controllers, _metrics
 
     abp = admin.base_path()
 
+    # Metrics collecting
+    for method in ('get', 'post', 'put'):
+        router.on_pre_dispatch(_metrics.on_pre_dispatch, method=method)
+        router.on_xhr_pre_dispatch(_metrics.on_pre_dispatch, method=method)
+        router.on_response(_metrics.on_response, method=method)
+        router.on_xhr_response(_metrics.on_response, method=method)
+
+    # Cache control of user specific responses
+    router.on_pre_dispatch(_http_api_controllers.on_pre_dispatch, method='get')
+    router.on_xhr_pre_dispatch(_http_api_controllers.on_pre_dispatch, method='get')
+    router.on_response(_http_api_controllers.on_response, method='get')
+    router.on_xhr_response(_http_api_controllers.on_response, method='get')
+
     # Browse route
     router.handle(_controllers.Browse, abp + '/odm_ui/<model>', 'odm_ui@admin_browse', filters=auth_ui.AuthFilter)
     router.handle(_controllers.Browse, 'odm_ui/<model>', 'odm_ui@browse', filters=auth_ui.AuthFilter)
 
+    # Browser events stream route
+    router.handle(_controllers.BrowserEvents, 'odm_ui/browser/events/<model>', 'odm_ui@browser_events',
+                  filters=auth_ui.AuthFilter)
+
     # Create/modify form routes
     router.handle(_controllers.Form, abp + '/odm_ui/<model>/modify/<eid>', 'odm_ui@admin_m_form',
                   filters=auth_ui.AuthFilter)
@@ -37,7 +74,13 @@ def plugin_load_wsgi():
     # HTTP API handlers
     http_api.handle('GET', 'odm_ui/browser/rows/<model>', _http_api_controllers.GetBrowserRows,
                     'odm_ui@get_browser_rows')
+    http_api.handle('GET', 'odm_ui/browser/children/<model>/<parent>', _http_api_controllers.GetBrowserRows,
+                    'odm_ui@get_browser_children')
+    http_api.handle('GET', 'odm_ui/browser/rows/<model>/delta', _http_api_controllers.GetBrowserRowsDelta,
+                    'odm_ui@get_browser_rows_delta')
     http_api.handle('PUT', 'odm_ui/browser/rows/<model>', _http_api_controllers.PutBrowserRows,
                     'odm_ui@put_browser_rows')
     http_api.handle('GET', 'odm_ui/widget/entity_select', _http_api_controllers.GetWidgetEntitySelect,
                     'odm_ui@widget_entity_select')
+    http_api.handle('GET', 'odm_ui/entities/<model>', _http_api_controllers.GetEntities, 'odm_ui@get_entities')
+    http_api.handle('GET', 'odm_ui/metrics', _http_api_controllers.GetMetrics, 'odm_ui@get_metrics')
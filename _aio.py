@@ -0,0 +1,57 @@
+"""PytSite Object Document Mapper UI Plugin Asyncio Support
+
+ODM entities are synchronous, so coroutines run controllers in the plugin's thread pool. Event loop is not blocked
+while a request waits for the database, and the same UIEntity hooks are called as by the WSGI controllers.
+
+Controllers are imported on first call, so importing the plugin does not load them along with the thread pools.
+"""
+__author__ = 'Oleksandr Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+import asyncio
+from typing import Mapping, Type, Union
+from pytsite import routing, http, router
+
+
+def _exec(controller_class: Type[routing.Controller], args: Mapping):
+    controller = controller_class()
+    controller.request = router.request()
+    controller.args.update(args)
+    controller.args.validate()
+
+    return controller.exec()
+
+
+async def _exec_async(controller_class: Type[routing.Controller], args: Mapping, request: http.Request = None):
+    from . import _executor
+
+    # Request is thread bound, so it is captured here and restored in the worker thread. Session is not available
+    # there, controllers of the plugin's HTTP API do not use it.
+    future = _executor.submit_controller(_exec, request or router.request(), controller_class, args)
+
+    return await asyncio.wrap_future(future)
+
+
+async def get_browser_rows(args: Mapping, request: http.Request = None) -> Union[dict, http.Response]:
+    """Async variant of odm_ui@get_browser_rows
+    """
+    from ._http_api_controllers import GetBrowserRows
+
+    return await _exec_async(GetBrowserRows, args, request)
+
+
+async def put_browser_rows(args: Mapping, request: http.Request = None) -> dict:
+    """Async variant of odm_ui@put_browser_rows
+    """
+    from ._http_api_controllers import PutBrowserRows
+
+    return await _exec_async(PutBrowserRows, args, request)
+
+
+async def widget_entity_select(args: Mapping, request: http.Request = None) -> dict:
+    """Async variant of odm_ui@widget_entity_select
+    """
+    from ._http_api_controllers import GetWidgetEntitySelect
+
+    return await _exec_async(GetWidgetEntitySelect, args, request)
@@ -4,10 +4,12 @@ __author__ = 'Oleksandr Shepetko'
 __email__ = 'a@shepetko.com'
 __license__ = 'MIT'
 
-from typing import Iterable, Type
+from typing import Iterable, Type, Dict
 from pytsite import router
 from plugins import odm, odm_auth, form
-from . import _model, _forms, _browser
+from . import _model, _forms, _browser, _profiler
+
+_mocks = {}  # type: Dict[str, _model.UIEntity]
 
 
 def get_model_class(model: str) -> Type[_model.UIEntity]:
@@ -20,6 +22,8 @@ def get_model_class(model: str) -> Type[_model.UIEntity]:
     if not issubclass(model_class, _model.UIEntity):
         raise TypeError('{} must extend {}'.format(model_class, _model.UIEntity))
 
+    _profiler.instrument(model, model_class)
+
     return model_class
 
 
@@ -31,9 +35,24 @@ def dispense_entity(model: str, entity_id: str = None) -> _model.UIEntity:
     if not isinstance(entity, _model.UIEntity):
         raise TypeError("Model '{}' must extend 'odm_ui.model.UIEntity'".format(model))
 
+    _profiler.instrument(model, entity.__class__)
+
     return entity
 
 
+def get_mock(model: str) -> _model.UIEntity:
+    """Get cached entity prototype of a model.
+
+    Prototype is dispensed once per process and is intended only to call hooks which do not depend on entity's state,
+    like finder adjusting ones. It must never be modified or saved.
+    """
+    mock = _mocks.get(model)
+    if not mock:
+        mock = _mocks[model] = dispense_entity(model)
+
+    return mock
+
+
 def get_browser(model: str, **kwargs) -> _browser.Browser:
     """Get entities browser
     """
@@ -0,0 +1,291 @@
+"""PytSite Object Document Mapper UI Plugin Benchmarks
+"""
+__author__ = 'Oleksandr Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+import json
+import random
+import subprocess
+import sys
+import tracemalloc
+from time import perf_counter
+from typing import Callable, List, Dict
+from werkzeug.test import EnvironBuilder
+from pytsite import console, router, http, mongodb
+from plugins import odm, auth
+from . import _model
+
+_MODEL = 'odm_ui_bench'
+
+# Runs in a fresh interpreter, prints timings in seconds as JSON
+_STARTUP_SCRIPT = '''
+import json
+from time import perf_counter
+t = perf_counter()
+import pytsite
+boot = perf_counter() - t
+from pytsite import lang
+from plugins.odm_ui import _collation
+t = perf_counter()
+_collation.get_collator(lang.get_current())
+first_use = perf_counter() - t
+print(json.dumps({'boot': boot, 'first_use': first_use}))
+'''
+
+_SYLLABLES = ('ka', 'lo', 'mi', 'ne', 'ru', 'sa', 'to', 'vi', 'ze', 'бо', 'ві', 'да', 'жи', 'ля', 'чу', 'єр')
+
+
+class BenchEntity(_model.UIEntity):
+    """Synthetic entity used by benchmarks
+    """
+
+    def _setup_fields(self):
+        super()._setup_fields()
+
+        self.define_field(odm.field.String('title', is_required=True))
+        self.define_field(odm.field.Integer('order'))
+        self.define_field(odm.field.Bool('enabled', default=True))
+
+    def _setup_indexes(self):
+        super()._setup_indexes()
+
+        self.define_index([('title', odm.I_ASC)])
+
+    def odm_ui_browser_setup(self, browser):
+        browser.data_fields = [
+            ('title', 'Title'),
+            ('order', 'Order'),
+            ('enabled', 'Enabled'),
+        ]
+        browser.default_sort_field = 'title'
+
+    def odm_ui_browser_row(self) -> dict:
+        return {
+            'title': self.f_get('title'),
+            'order': self.f_get('order'),
+            'enabled': self.f_get('enabled'),
+        }
+
+    def odm_ui_widget_select_search_entities(self, f: odm.MultiModelFinder, args: dict):
+        query = args.get('q')
+        if query:
+            f.regex('title', '^' + query, True)
+
+    def odm_ui_widget_select_search_entities_title(self, args: dict) -> str:
+        return self.f_get('title')
+
+
+def _random_title() -> str:
+    return ' '.join(''.join(random.choice(_SYLLABLES) for _ in range(random.randint(2, 4)))
+                    for _ in range(random.randint(1, 3)))
+
+
+def _db_ops() -> int:
+    """Get number of operations performed by the database server so far
+    """
+    counters = mongodb.get_database().command('serverStatus')['opcounters']
+
+    return sum(counters.values())
+
+
+def _percentile(values: List[float], p: int) -> float:
+    values = sorted(values)
+
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+class Bench(console.Command):
+    """Benchmark ODM UI Hot Paths Command
+    """
+
+    def __init__(self):
+        super().__init__()
+
+        self.define_option(console.option.PositiveInt('rows', default=1000))
+        self.define_option(console.option.Int('depth', default=0))
+        self.define_option(console.option.PositiveInt('limit', default=50))
+        self.define_option(console.option.PositiveInt('iterations', default=20))
+        self.define_option(console.option.Bool('keep'))
+
+        self._entities = []  # type: List[BenchEntity]
+        self._delete_eids = []  # type: List[str]
+
+    @property
+    def name(self) -> str:
+        """Get name of the command
+        """
+        return 'odm_ui:bench'
+
+    @property
+    def description(self) -> str:
+        """Get description of the command
+        """
+        return 'odm_ui@console_command_description_bench'
+
+    @property
+    def signature(self) -> str:
+        """Get signature of the command
+        """
+        return '{} [{}]'.format(super().signature, '|'.join(self._scenarios().keys()))
+
+    def _scenarios(self) -> Dict[str, Callable]:
+        return {
+            'browse': self._browse,
+            'browse_deep': self._browse_deep,
+            'select': self._select,
+            'm_form': self._m_form,
+            'reorder': self._reorder,
+            'delete': self._delete,
+            'startup': self._startup,
+        }
+
+    def _create_entities(self, num: int, depth: int = 0) -> List[BenchEntity]:
+        """Create entities, evenly distributed over `depth + 1` tree levels
+        """
+        r = []
+        levels = [[] for _ in range(depth + 1)]
+        for i in range(num):
+            level = i * (depth + 1) // num
+            e = odm.dispense(_MODEL)  # type: BenchEntity
+            e.f_set('title', _random_title()).f_set('order', i)
+            if level:
+                e.f_set('_parent', random.choice(levels[level - 1]))
+            e.save()
+            levels[level].append(e)
+            r.append(e)
+
+        return r
+
+    def _browse(self, i: int):
+        from ._browser import Browser
+
+        Browser(_MODEL).get_rows({'offset': 0, 'limit': self.opt('limit')})
+
+    def _browse_deep(self, i: int):
+        from ._browser import Browser
+
+        limit = self.opt('limit')
+        Browser(_MODEL).get_rows({'offset': max(0, self.opt('rows') - limit), 'limit': limit})
+
+    def _select(self, i: int):
+        from ._http_api_controllers import GetWidgetEntitySelect
+
+        c = GetWidgetEntitySelect()
+        c.args.update({
+            'model': '["{}"]'.format(_MODEL),
+            'sort_by': 'title',
+            'q': _SYLLABLES[i % len(_SYLLABLES)],
+        })
+        c.exec()
+
+    def _m_form(self, i: int):
+        from ._forms import Modify
+
+        Modify(router.request(), model=_MODEL, eid=str(self._entities[i % len(self._entities)].id))
+
+    def _reorder(self, i: int):
+        from ._http_api_controllers import PutBrowserRows
+
+        rows = []
+        for e in random.sample(self._entities, min(self.opt('limit'), len(self._entities))):
+            rows.append({'__id': str(e.id), '__parent': str(e.parent.id) if e.parent else None, 'order': i})
+
+        c = PutBrowserRows()
+        c.args.update({'model': _MODEL, 'rows': rows})
+        c.exec()
+
+    def _delete_setup(self) -> List[str]:
+        return [str(e.id) for e in self._create_entities(self.opt('limit'))]
+
+    def _delete(self, i: int):
+        from ._forms import Delete
+
+        Delete(router.request(), model=_MODEL, eids=self._delete_eids).delete_entities()
+
+    def _startup(self, i: int) -> Dict[str, float]:
+        """Boot application in a fresh interpreter and time plugin's import and first use of the collator
+        """
+        p = subprocess.run([sys.executable, '-X', 'importtime', '-c', _STARTUP_SCRIPT], stdout=subprocess.PIPE,
+                           stderr=subprocess.PIPE, universal_newlines=True, check=True)
+
+        r = json.loads(p.stdout.strip().splitlines()[-1])
+
+        # Line format: 'import time: self [us] | cumulative | imported package'
+        for line in p.stderr.splitlines():
+            parts = [part.strip() for part in line.split('|')]
+            if len(parts) == 3 and parts[2] == 'plugins.odm_ui':
+                r['import'] = int(parts[1]) / 1000000
+
+        return r
+
+    def _measure_startup(self):
+        runs = [self._startup(i) for i in range(self.opt('iterations'))]
+
+        def p50(key: str) -> float:
+            return _percentile([run.get(key, 0) * 1000 for run in runs], 50)
+
+        console.print_normal('{:<12} boot {:>9.2f} ms  import {:>9.2f} ms  first use {:>9.2f} ms'.
+                             format('startup', p50('boot'), p50('import'), p50('first_use')))
+
+    def _measure(self, name: str, fn: Callable[[int], None]):
+        timings = []
+        db_ops = 0
+        iterations = self.opt('iterations')
+
+        for i in range(iterations):
+            if name == 'delete':
+                self._delete_eids = self._delete_setup()
+
+            ops_before = _db_ops()
+            t_start = perf_counter()
+            fn(i)
+            timings.append((perf_counter() - t_start) * 1000)
+            db_ops += _db_ops() - ops_before - 1  # The serverStatus command itself is counted too
+
+        # Separate run to measure allocations, because tracing slows down execution a lot
+        if name == 'delete':
+            self._delete_eids = self._delete_setup()
+        tracemalloc.start()
+        fn(iterations)
+        allocated, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        console.print_normal('{:<12} p50 {:>9.2f} ms  p90 {:>9.2f} ms  p99 {:>9.2f} ms  max {:>9.2f} ms  '
+                             'db ops {:>7.1f}  alloc peak {:>8.1f} KiB'.
+                             format(name, _percentile(timings, 50), _percentile(timings, 90),
+                                    _percentile(timings, 99), max(timings), db_ops / iterations, peak / 1024))
+
+    def exec(self):
+        """Execute the command
+        """
+        scenarios = self._scenarios()
+
+        # Startup scenario boots application several times, so it is run only on demand
+        selected = self.args or [name for name in scenarios if name != 'startup']
+        for name in selected:
+            if name not in scenarios:
+                raise console.error.InvalidArgument(0, name)
+
+        odm.register_model(_MODEL, BenchEntity, True)
+
+        # Entities browser and forms require request context
+        router.set_request(http.Request(EnvironBuilder(path='/', base_url=router.base_url()).get_environ()))
+
+        auth.switch_user_to_system()
+        try:
+            odm.dispense(_MODEL).collection.drop()
+
+            console.print_info('Creating {} entities, tree depth {}'.format(self.opt('rows'), self.opt('depth')))
+            self._entities = self._create_entities(self.opt('rows'), self.opt('depth'))
+
+            for name in selected:
+                if name == 'startup':
+                    self._measure_startup()
+                else:
+                    self._measure(name, scenarios[name])
+
+        finally:
+            if not self.opt('keep'):
+                odm.dispense(_MODEL).collection.drop()
+            auth.restore_user()
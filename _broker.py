@@ -0,0 +1,130 @@
+"""PytSite Object Document Mapper UI Plugin Messages Broker
+"""
+__author__ = 'Oleksandr Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+from typing import Dict, Optional, Set
+from abc import ABC, abstractmethod
+from queue import Queue, Empty, Full
+from threading import Lock
+
+
+class Subscription(ABC):
+    """Subscription to a broker's channel
+    """
+
+    @abstractmethod
+    def get(self, timeout: float) -> Optional[dict]:
+        """Wait for a message, return None if nothing has been received within timeout
+        """
+        pass
+
+    @abstractmethod
+    def close(self):
+        """Unsubscribe
+        """
+        pass
+
+
+class Backend(ABC):
+    """Abstract broker backend
+    """
+
+    @abstractmethod
+    def publish(self, channel: str, message: dict):
+        """Publish a message to a channel
+        """
+        pass
+
+    @abstractmethod
+    def subscribe(self, channel: str) -> Subscription:
+        """Subscribe to a channel
+        """
+        pass
+
+
+class _InProcessSubscription(Subscription):
+    def __init__(self, backend, channel: str, queue: Queue):
+        self._backend = backend  # type: InProcessBackend
+        self._channel = channel
+        self._queue = queue
+
+    def get(self, timeout: float) -> Optional[dict]:
+        try:
+            return self._queue.get(timeout=timeout)
+        except Empty:
+            return None
+
+    def close(self):
+        self._backend.unsubscribe(self._channel, self._queue)
+
+
+class InProcessBackend(Backend):
+    """In-process broker backend, suitable only for single node deployments
+    """
+
+    def __init__(self, queue_size: int = 1000):
+        self._queue_size = queue_size
+        self._queues = {}  # type: Dict[str, Set[Queue]]
+        self._lock = Lock()
+
+    def publish(self, channel: str, message: dict):
+        with self._lock:
+            queues = list(self._queues.get(channel, ()))
+
+        for q in queues:
+            try:
+                q.put_nowait(message)
+            except Full:
+                # Slow subscriber must not block publisher
+                pass
+
+    def subscribe(self, channel: str) -> Subscription:
+        q = Queue(self._queue_size)
+        with self._lock:
+            self._queues.setdefault(channel, set()).add(q)
+
+        return _InProcessSubscription(self, channel, q)
+
+    def unsubscribe(self, channel: str, queue: Queue):
+        with self._lock:
+            queues = self._queues.get(channel)
+            if queues:
+                queues.discard(queue)
+                if not queues:
+                    del self._queues[channel]
+
+
+_backend = None  # type: Optional[Backend]
+
+
+def set_backend(backend: Backend):
+    """Set broker backend
+    """
+    global _backend
+
+    _backend = backend
+
+
+def get_backend() -> Backend:
+    """Get broker backend
+    """
+    global _backend
+
+    if not _backend:
+        _backend = InProcessBackend()
+
+    return _backend
+
+
+def publish(channel: str, message: dict):
+    """Publish a message to a channel
+    """
+    get_backend().publish(channel, message)
+
+
+def subscribe(channel: str) -> Subscription:
+    """Subscribe to a channel
+    """
+    return get_backend().subscribe(channel)
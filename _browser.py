@@ -5,11 +5,18 @@ __email__ = 'a@shepetko.com'
 __license__ = 'MIT'
 
 import htmler
-from typing import Union
-from pytsite import router, lang, events, routing, errors
+import hashlib
+import json
+from typing import Union, Iterable, List, Dict
+from bson import ObjectId, DBRef
+from pymongo.errors import ExecutionTimeout
+from pytsite import router, lang, events, routing, errors, reg
 from plugins import widget, auth, odm, http_api, odm_auth
 from plugins.odm_auth import PERM_CREATE, PERM_MODIFY, PERM_DELETE, PERM_MODIFY_OWN, PERM_DELETE_OWN
-from . import _api
+from . import _api, _metrics, _changes, _executor, _indexes
+
+# Arguments which do not affect number of rows
+_COUNT_TOKEN_SKIP_ARGS = ('offset', 'limit', 'sort', 'order', 'total', 'count_token', 'format', '_')
 
 
 class Browser:
@@ -33,6 +40,7 @@ class Browser:
         self._model_class = _api.get_model_class(self._model)
 
         self._current_user = auth.get_current_user()
+        self._sort = []
         self._browse_rule = kwargs.get('browse_rule', self._model_class.odm_ui_browse_rule())
         self._m_form_rule = kwargs.get('m_form_rule', self._model_class.odm_ui_m_form_rule())
         self._d_form_rule = kwargs.get('d_form_rule', self._model_class.odm_ui_d_form_rule())
@@ -41,14 +49,18 @@ class Browser:
         widget_class = self._model_class.odm_ui_browser_widget_class()
         if not (issubclass(widget_class, widget.misc.DataTable)):
             raise TypeError('Subclass of {} expected, got'.format(widget.misc.DataTable, widget_class))
+        rows_url_args = {
+            'model': self._model,
+            'browse_rule': self._browse_rule,
+            'm_form_rule': self._m_form_rule,
+            'd_form_rule': self._d_form_rule,
+        }
+        if reg.get('odm_ui.browser_compact_rows', False):
+            rows_url_args['format'] = 'compact'
+        self._rows_url = http_api.url('odm_ui@get_browser_rows', rows_url_args)
         self._widget = widget_class(
             uid='odm-ui-browser-' + model,
-            rows_url=http_api.url('odm_ui@get_browser_rows', {
-                'model': self._model,
-                'browse_rule': self._browse_rule,
-                'm_form_rule': self._m_form_rule,
-                'd_form_rule': self._d_form_rule,
-            }),
+            rows_url=self._rows_url,
             update_rows_url=http_api.url('odm_ui@put_browser_rows', {'model': model})
         )
 
@@ -62,6 +74,9 @@ class Browser:
         if not self.data_fields:
             raise RuntimeError('No data fields was defined')
 
+        # Create indexes required to sort and filter rows
+        _indexes.ensure(self)
+
         # Actions column
         if self._model_class.odm_ui_entity_actions_enabled() and \
                 (self._model_class.odm_ui_modification_allowed() or self._model_class.odm_ui_deletion_allowed()):
@@ -124,91 +139,362 @@ class Browser:
 
         self._widget.default_sort_order = value
 
+    @property
+    def page_size(self) -> int:
+        # Widgets which do not specify page size use default one of bootstrap-table
+        return getattr(self._widget, 'page_size', None) or 10
+
     def insert_data_field(self, name: str, title: str = None, sortable: bool = True, pos: int = None):
         self._widget.insert_data_field(name, title, sortable, pos)
 
     def remove_data_field(self, name: str):
         self._widget.remove_data_field(name)
 
-    def get_rows(self, args: routing.ControllerArgs) -> dict:
-        """Get browser rows.
+    def is_tree_mode(self, args: routing.ControllerArgs) -> bool:
+        """Check if rows should be loaded level by level
         """
-        # Instantiate finder
-        finder = odm.find(self._model)
+        # Search results are shown as a flat list
+        return self._model_class.odm_ui_browser_tree_mode() and not args.get('search')
 
-        # Check if the user can modify/delete any entity
-        if not odm_auth.check_model_permissions(self._model, [PERM_MODIFY, PERM_DELETE]) and \
-                odm_auth.check_model_permissions(self._model, [PERM_MODIFY_OWN, PERM_DELETE_OWN]):
+    def is_owner_scoped(self) -> bool:
+        """Check if current user is allowed to modify/delete own entities only
+        """
+        return not odm_auth.check_model_permissions(self._model, [PERM_MODIFY, PERM_DELETE]) and \
+            odm_auth.check_model_permissions(self._model, [PERM_MODIFY_OWN, PERM_DELETE_OWN])
+
+    def _apply_owner_filter(self, finder: odm.SingleModelFinder):
+        if self.is_owner_scoped():
             # Show only entities owned by user
             finder.mock.has_field('author') and finder.eq('author', self._current_user)
 
+    def _get_finder(self, args: routing.ControllerArgs, by_parent: bool = True) -> odm.SingleModelFinder:
+        """Get finder set up according to browser's arguments
+        """
+        # Instantiate finder
+        finder = odm.find(self._model)
+
+        self._apply_owner_filter(finder)
+
         # Let model to finish finder setup
-        _api.dispense_entity(self._model).odm_ui_browser_setup_finder(finder, args)
+        _api.get_mock(self._model).odm_ui_browser_setup_finder(finder, args)
 
         # Sort
+        self._sort = []
         sort_order = odm.I_DESC if args.get('order', self.default_sort_order) in (-1, 'desc') else odm.I_ASC
         sort_field = args.get('sort')
         if sort_field and finder.mock.has_field(sort_field):
-            finder.sort([(sort_field, sort_order)])
+            self._sort = [(sort_field, sort_order)]
+            _indexes.use_sort(self, sort_field, sort_order)
         elif self.default_sort_field:
-            finder.sort([(self.default_sort_field, sort_order)])
+            self._sort = [(self.default_sort_field, sort_order)]
+        if self._sort:
+            finder.sort(self._sort)
+
+        if self.is_tree_mode(args):
+            # Get single level of the tree
+            if by_parent:
+                parent = args.get('parent')
+                finder.eq('_parent', odm.dispense(self._model, parent) if parent else None)
+        else:
+            # Get root elements first
+            finder.add_sort('_parent', pos=0)
+            self._sort.insert(0, ('_parent', odm.I_ASC))
+
+        return finder
+
+    def _get_entities(self, finder: odm.SingleModelFinder, offset: int, limit: int, time_budget: int) -> List:
+        """Get a page of entities
+
+        If time budget is set, IDs are selected by a raw query which is aborted by the database server after
+        `time_budget` milliseconds with pymongo.errors.ExecutionTimeout.
+        """
+        if not time_budget:
+            return list(finder.skip(offset).get(limit))
 
-        # Get root elements first
-        finder.add_sort('_parent', pos=0)
+        cursor = finder.mock.collection.find(finder.query.compile(), {'_id': 1}, skip=offset, limit=limit,
+                                             sort=self._sort or None).max_time_ms(time_budget)
+        ids = [doc['_id'] for doc in cursor]
+        if not ids:
+            return []
 
-        # Prepare result
-        r = {
-            'total': finder.count(),
-            'rows': []
-        }
+        by_id = {e.id: e for e in odm.find(self._model).inc('_id', ids).get()}
 
-        # Build table rows
-        cursor = finder.skip(args.get('offset', 0)).get(args.get('limit', 0))
-        for entity in cursor:
-            row = entity.odm_ui_browser_row()
-            events.fire('odm_ui@browser_row.{}'.format(self._model), entity=entity, row=row)
+        return [by_id[i] for i in ids if i in by_id]
 
-            if not row:
-                continue
+    def _count_children(self, entities: List[odm.Entity], args: routing.ControllerArgs) -> Dict[str, int]:
+        """Count children of entities which are visible in the browser using single aggregation query
+        """
+        if not entities:
+            return {}
+
+        finder = odm.find(self._model).inc('_parent', entities)
+        self._apply_owner_filter(finder)
+        _api.get_mock(self._model).odm_ui_browser_setup_finder(finder, args)
+
+        r = {}
+        pipeline = [
+            {'$match': finder.query.compile()},
+            {'$group': {'_id': '$_parent', 'count': {'$sum': 1}}},
+        ]
+        for item in finder.mock.collection.aggregate(pipeline):
+            parent = item['_id']
+            if isinstance(parent, DBRef):
+                parent = parent.id
+            elif isinstance(parent, str) and ':' in parent:
+                # Reference stored as a string 'model:id'
+                parent = parent.split(':')[-1]
+            r[str(parent)] = item['count']
 
-            # Build row's cells
-            fields_data = {
-                '__id': str(entity.id),
-                '__parent': str(entity.parent.id) if entity.parent else None,
-            }
+        return r
 
-            if not isinstance(row, dict):
-                raise TypeError('{}.odm_ui_browser_row() must return dict, got {}'.
-                                format(entity.__class__.__name__, type(row)))
+    def _build_rows(self, entities: List[odm.Entity], parent: str = None, tree_mode: bool = False,
+                    compact: bool = False, args: routing.ControllerArgs = None) -> List[dict]:
+        """Build table rows
 
-            for df in self.data_fields:
-                fields_data[df[0]] = row.get(df[0], '&nbsp;')
+        If `compact` is True, action buttons are not rendered, but returned as data.
+        """
+        r = []
+
+        children_count = {}
+        if tree_mode:
+            with _metrics.phase('count_children'):
+                children_count = self._count_children(entities, args or {})
+
+        for entity in entities:
+            with _metrics.phase('row'):
+                row = entity.odm_ui_browser_row()
+
+            with _metrics.phase('row_events'):
+                events.fire('odm_ui@browser_row.{}'.format(self._model), entity=entity, row=row)
+
+            if not row:
+                continue
+
+            with _metrics.phase('row'):
+                # Build row's cells
+                eid = str(entity.id)
+                if tree_mode:
+                    # All rows belong to the same parent, so it is not necessary to load it for each row
+                    fields_data = {
+                        '__id': eid,
+                        '__parent': parent,
+                        '__children': children_count.get(eid, 0),
+                    }
+                else:
+                    fields_data = {
+                        '__id': eid,
+                        '__parent': str(entity.parent.id) if entity.parent else None,
+                    }
+
+                if not isinstance(row, dict):
+                    raise TypeError('{}.odm_ui_browser_row() must return dict, got {}'.
+                                    format(entity.__class__.__name__, type(row)))
+
+                for df in self.data_fields:
+                    fields_data[df[0]] = row.get(df[0], '&nbsp;')
 
             # Action buttons
             if self._model_class.odm_ui_entity_actions_enabled() and \
                     (self._model_class.odm_ui_modification_allowed() or self._model_class.odm_ui_deletion_allowed()):
+                with _metrics.phase('actions'):
+                    actions = self._get_actions(entity)
+                    fields_data['entity-actions'] = actions if compact else self._render_actions(actions)
+
+            r.append(fields_data)
+
+        return r
+
+    def _get_actions(self, entity: odm.Entity) -> List[dict]:
+        """Get normalized action buttons data of an entity
+        """
+        r = []
+
+        for btn_data in entity.odm_ui_browser_entity_actions(self):
+            url = btn_data.get('url')
+            if not url:
+                rule = btn_data.get('rule')
+                url = router.rule_url(rule, {'ids': str(entity.id)}) if rule else '#'
+
+            color = btn_data.get('color', 'default btn-light')
+            r.append({
+                'url': url,
+                'css': 'btn btn-sm btn-{} {}'.format(color, btn_data.get('css', '')),
+                'title': btn_data.get('title', ''),
+                'icon': btn_data.get('icon', 'fa fas fa-fw fa-question'),
+                'disabled': bool(btn_data.get('disabled')),
+            })
+
+        return r
+
+    @staticmethod
+    def _render_actions(actions: List[dict]) -> str:
+        """Render action buttons
+        """
+        r = htmler.TagLessElement(child_sep='&nbsp;')
 
-                actions = htmler.TagLessElement(child_sep='&nbsp;')
-                for btn_data in entity.odm_ui_browser_entity_actions(self):
-                    color = 'btn btn-sm btn-' + btn_data.get('color', 'default btn-light')
-                    title = btn_data.get('title', '')
-                    url = btn_data.get('url')
-                    if not url:
-                        rule = btn_data.get('rule')
-                        url = router.rule_url(rule, {'ids': str(entity.id)}) if rule else '#'
-                    btn = htmler.A(href=url, css=color + ' ' + btn_data.get('css', ''), title=title, role='button')
-                    if btn_data.get('disabled'):
-                        btn.set_attr('aria_disabled', 'true')
-                        btn.add_css('disabled')
-                    btn.append_child(htmler.I(css=btn_data.get('icon', 'fa fas fa-fw fa-question')))
-                    actions.append_child(btn)
-
-                fields_data['entity-actions'] = actions.render()
-
-            r['rows'].append(fields_data)
+        for action in actions:
+            btn = htmler.A(href=action['url'], css=action['css'], title=action['title'], role='button')
+            if action['disabled']:
+                btn.set_attr('aria_disabled', 'true')
+                btn.add_css('disabled')
+            btn.append_child(htmler.I(css=action['icon']))
+            r.append_child(btn)
+
+        return r.render()
+
+    @staticmethod
+    def _compact_rows(rows: List[dict]) -> dict:
+        """Convert rows to columnar format
+
+        Column names are sent once and rows become arrays. Action buttons are replaced by indices of templates, where
+        entity's ID in URL is replaced by the `__ID__` placeholder.
+        """
+        columns = list(rows[0].keys()) if rows else []
+        templates = []
+        templates_index = {}
+
+        r = []
+        for row in rows:
+            actions = row.get('entity-actions')
+            if actions is not None:
+                indices = []
+                for action in actions:
+                    template = dict(action, url=action['url'].replace(row['__id'], '__ID__'))
+                    key = json.dumps(template, sort_keys=True)
+                    if key not in templates_index:
+                        templates_index[key] = len(templates)
+                        templates.append(template)
+                    indices.append(templates_index[key])
+                row = dict(row, **{'entity-actions': indices})
+
+            r.append([row.get(c) for c in columns])
+
+        return {'columns': columns, 'rows': r, 'actions': templates}
+
+    def _get_count_token(self, args: routing.ControllerArgs) -> str:
+        """Get token which stays the same while number of entities matching arguments cannot change
+        """
+        return hashlib.md5(json.dumps([
+            self._model,
+            _changes.get_version(self._model),
+            self._current_user.uid,
+            sorted((k, v) for k, v in args.items() if k not in _COUNT_TOKEN_SKIP_ARGS),
+        ], default=str).encode()).hexdigest()
+
+    @staticmethod
+    def _get_timeout_rows(offset: int) -> dict:
+        """Get response for a page query aborted by time budget
+        """
+        return {
+            'total': 0,
+            'rows': [],
+            'offset': offset,
+            'timeout': True,
+            'message': lang.t('odm_ui@refine_search'),
+        }
+
+    def get_rows(self, args: routing.ControllerArgs) -> dict:
+        """Get browser rows.
+        """
+        with _metrics.phase('setup_finder'):
+            finder = self._get_finder(args)
+
+        # Total number of rows is not counted again, if client already knows it
+        count_token = self._get_count_token(args)
+        total = args.get('total') if args.get('count_token') == count_token else None
+
+        # Count and page queries are performed concurrently
+        time_budget = reg.get('odm_ui.browser_time_budget', 0)
+        count_future = None
+        if total is None:
+            query = finder.query.compile()
+            count_kwargs = {'maxTimeMS': time_budget} if time_budget else {}
+            count_future = _executor.submit(finder.mock.collection.count_documents, query, **count_kwargs)
+
+        offset = args.get('offset', 0)
+        limit = args.get('limit', 0)
+
+        try:
+            with _metrics.phase('cursor'):
+                entities = self._get_entities(finder, offset, limit, time_budget)
+        except ExecutionTimeout:
+            if count_future:
+                count_future.cancel()
+            return self._get_timeout_rows(offset)
+
+        r = {
+            'count_token': count_token,
+            'rows': [],
+        }
+
+        with _metrics.phase('count'):
+            if count_future:
+                try:
+                    total = count_future.result()
+                except ExecutionTimeout:
+                    # Just enough to let client to request the next page
+                    total = offset + len(entities) + (1 if limit and len(entities) == limit else 0)
+                    r['total_estimated'] = True
+                    r['count_token'] = None
+
+        r['total'] = total
+
+        # Clamp offset to the last non-empty page, i.e. after mass deletion
+        if limit and total and offset >= total:
+            offset = max(0, (total - 1) // limit * limit)
+            try:
+                with _metrics.phase('cursor'):
+                    entities = self._get_entities(finder, offset, limit, time_budget)
+            except ExecutionTimeout:
+                return self._get_timeout_rows(offset)
+        r['offset'] = offset
+
+        tree_mode = self.is_tree_mode(args)
+        compact = args.get('format') == 'compact'
+        rows = self._build_rows(entities, args.get('parent') if tree_mode else None, tree_mode, compact, args)
+        if compact:
+            r['format'] = 'compact'
+            r.update(self._compact_rows(rows))
+        else:
+            r['rows'] = rows
 
         return r
 
+    def get_finder(self, args: Union[routing.ControllerArgs, dict]) -> odm.SingleModelFinder:
+        """Get finder of all entities matching browser's arguments, regardless of tree level and page.
+        """
+        return self._get_finder(args, False)
+
+    def get_rows_by_ids(self, args: routing.ControllerArgs, ids: Iterable[str]) -> List[dict]:
+        """Get rows of entities which match browser's arguments among specified ones.
+        """
+        with _metrics.phase('setup_finder'):
+            finder = self._get_finder(args, False).inc('_id', [ObjectId(i) for i in ids])
+
+        with _metrics.phase('cursor'):
+            entities = list(finder.get())
+
+        return self._build_rows(entities)
+
+    def _get_first_page(self) -> dict:
+        """Get first page of rows along with arguments it was built for
+        """
+        args = {
+            'offset': 0,
+            'limit': self.page_size,
+            'sort': self.default_sort_field,
+            'order': 'desc' if self.default_sort_order == odm.I_DESC else 'asc',
+        }
+        if reg.get('odm_ui.browser_compact_rows', False):
+            args['format'] = 'compact'
+
+        # Token must be taken before querying to not miss changes made during it
+        sync_token = _changes.get_sync_token(self._model)
+        response = self.get_rows(args)
+        response['sync_token'] = sync_token
+
+        return {'url': self._rows_url, 'args': args, 'response': response}
+
     def render(self) -> str:
         # 'Create' toolbar button
         if self._model_class.odm_ui_creation_allowed() and odm_auth.check_model_permissions(self._model, PERM_CREATE):
@@ -228,6 +514,7 @@ class Browser:
             delete_form_url = router.rule_url(self._d_form_rule, {'model': self._model})
             title = lang.t('odm_ui@delete_selected')
             btn = htmler.A(href=delete_form_url, css='hidden btn btn-danger mass-action-button sr-only', title=title)
+            btn.set_attr('data_query_enabled', 'true')
             btn.append_child(htmler.I(css='fa fas fa-fw fa-remove fa-times'))
             self._widget.toolbar.append_child(btn)
             self._widget.toolbar.append_child(htmler.Span('&nbsp;'))
@@ -239,13 +526,52 @@ class Browser:
             css = 'btn btn-{} mass-action-button'.format(btn_data.get('color', 'default btn-light'))
             icon = 'fa fas fa-fw fa-' + btn_data.get('icon', 'question')
             button = htmler.A(href=url, css=css, title=btn_data.get('title'))
+            if btn_data.get('query_enabled'):
+                button.set_attr('data_query_enabled', 'true')
             if icon:
                 button.append_child(htmler.I(css=icon))
             self._widget.toolbar.append_child(button)
             self._widget.toolbar.append_child(htmler.Span('&nbsp;'))
 
+        # Mass actions may be applied to all entities matching browser's query, not only to selected ones
+        title = lang.t('odm_ui@select_all_matching')
+        btn = htmler.A(href='#', css='hidden btn btn-default btn-light select-all-matching-button', title=title)
+        btn.append_child(htmler.I(css='fa fas fa-fw fa-check-double'))
+        btn.append_child(htmler.Span(title, css='sr-only'))
+        self._widget.toolbar.append_child(btn)
+        self._widget.toolbar.append_child(htmler.Span('&nbsp;'))
+
         frm = htmler.Form(self._widget.render(), action='#', method='post', css='table-responsive odm-ui-browser')
 
+        # Children of a tree node are loaded on demand
+        if self._model_class.odm_ui_browser_tree_mode():
+            frm.set_attr('data_children_url', http_api.url('odm_ui@get_browser_children', {
+                'model': self._model,
+                'parent': '__PARENT__',
+                'browse_rule': self._browse_rule,
+                'm_form_rule': self._m_form_rule,
+                'd_form_rule': self._d_form_rule,
+            }))
+
+        # First page of rows, so client does not need to request it
+        if reg.get('odm_ui.browser_embed_first_page', False):
+            frm.set_attr('data_first_page', json.dumps(self._get_first_page(), default=str, separators=(',', ':')))
+
+        # Incremental updates of displayed rows, either polled or pushed by server
+        delta_interval = reg.get('odm_ui.browser_delta_interval', 0)
+        events_enabled = reg.get('odm_ui.browser_events', False)
+        if delta_interval or events_enabled:
+            frm.set_attr('data_delta_url', http_api.url('odm_ui@get_browser_rows_delta', {
+                'model': self._model,
+                'browse_rule': self._browse_rule,
+                'm_form_rule': self._m_form_rule,
+                'd_form_rule': self._d_form_rule,
+            }))
+            frm.set_attr('data_delta_interval', delta_interval)
+
+            if events_enabled:
+                frm.set_attr('data_events_url', router.rule_url('odm_ui@browser_events', {'model': self._model}))
+
         return frm.render()
 
     def __str__(self) -> str:
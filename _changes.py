@@ -0,0 +1,104 @@
+"""PytSite Object Document Mapper UI Plugin Entities Changes Tracking
+"""
+__author__ = 'Oleksandr Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+from typing import List, Optional
+from uuid import uuid4
+from pymongo import ReturnDocument
+from pymongo.collection import Collection
+from pytsite import cache, reg, mongodb
+from plugins import odm
+from . import _model, _broker
+
+_cache_pool = cache.create_pool('odm_ui@changes')
+
+
+def get_version(model: str) -> str:
+    """Get current version of model's entities collection
+
+    Version changes every time an entity of the model is saved or deleted.
+    """
+    try:
+        return _cache_pool.get('version.' + model)
+    except cache.error.KeyNotExist:
+        return ''
+
+
+def _bump_version(model: str):
+    # Random token instead of a counter, because get-increment-put is not atomic across processes
+    _cache_pool.put('version.' + model, uuid4().hex)
+
+
+def _get_sequence() -> Collection:
+    return mongodb.get_collection('odm_ui_changes_sequence')
+
+
+def _next_sequence_number(model: str) -> int:
+    # Sequence numbers are assigned by the database, so they are monotonic across processes and nodes, unlike clocks
+    doc = _get_sequence().find_one_and_update({'_id': model}, {'$inc': {'seq': 1}}, upsert=True,
+                                              return_document=ReturnDocument.AFTER)
+
+    return doc['seq']
+
+
+def get_sync_token(model: str) -> int:
+    """Get a sync token to request changes of model's entities which will be made after this moment
+    """
+    doc = _get_sequence().find_one({'_id': model})
+
+    return doc['seq'] if doc else 0
+
+
+def get_changes(model: str, since: int) -> Optional[List[list]]:
+    """Get [sequence number, entity ID, operation] items of changes made since a sync token
+
+    Returns None if the log does not reach back to the token anymore, so the caller should reload everything.
+    """
+    try:
+        if since < _cache_pool.get('log_trimmed.' + model):
+            return None
+    except cache.error.KeyNotExist:
+        pass
+
+    try:
+        return [item for item in _cache_pool.get_list('log.' + model) if item[0] > since]
+    except cache.error.KeyNotExist:
+        return []
+
+
+def get_channel(model: str) -> str:
+    """Get name of the broker's channel to which changes of model's entities are published
+    """
+    return 'odm_ui.browser.' + model
+
+
+def _log_change(model: str, eid: str, op: str):
+    seq = _next_sequence_number(model)
+    key = 'log.' + model
+    size = _cache_pool.list_r_push(key, [seq, eid, op])
+
+    _broker.publish(get_channel(model), {'token': seq, 'id': eid, 'op': op})
+
+    # Keep log bounded
+    while size > reg.get('odm_ui.changes_log_size', 1000):
+        item = _cache_pool.list_l_pop(key)
+        _cache_pool.put('log_trimmed.' + model, item[0])
+        size -= 1
+
+
+def on_entity_save(entity: odm.Entity, **kwargs):
+    """odm@entity.save event handler
+    """
+    if isinstance(entity, _model.UIEntity):
+        _bump_version(entity.model)
+        _log_change(entity.model, str(entity.id), 'insert' if kwargs.get('first_save') else 'save')
+
+
+def on_entity_delete(entity: odm.Entity, **kwargs):
+    """odm@entity.delete event handler
+    """
+    if isinstance(entity, _model.UIEntity):
+        _bump_version(entity.model)
+        _log_change(entity.model, str(entity.id), 'delete')
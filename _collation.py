@@ -0,0 +1,69 @@
+"""PytSite Object Document Mapper UI Plugin Collation
+"""
+__author__ = 'Oleksandr Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+from typing import Callable, Dict, Iterable, List, Optional
+from functools import lru_cache
+from threading import Lock
+from pyuca import Collator
+from pytsite import lang, reg
+from plugins import odm
+
+_default_collator = None  # type: Optional[Collator]
+_collators = {}  # type: Dict[str, Collator]
+_factories = {}  # type: Dict[str, Callable[[], Collator]]
+_lock = Lock()
+
+
+def register_collator(language: str, factory: Callable[[], Collator]):
+    """Register a collator factory to be used for a language instead of the default DUCET collator
+    """
+    with _lock:
+        _factories[language] = factory
+        _collators.pop(language, None)
+
+    sort_key.cache_clear()
+
+
+def get_collator(language: str = None) -> Collator:
+    """Get collator for a language
+
+    Collators are created on first use and shared within the process. Languages without registered collators share
+    the default DUCET one.
+    """
+    global _default_collator
+
+    if not language:
+        language = lang.get_current()
+
+    collator = _collators.get(language)
+    if collator:
+        return collator
+
+    with _lock:
+        if language not in _collators:
+            if language in _factories:
+                _collators[language] = _factories[language]()
+            else:
+                if not _default_collator:
+                    _default_collator = Collator()
+                _collators[language] = _default_collator
+
+        return _collators[language]
+
+
+@lru_cache(maxsize=reg.get('odm_ui.sort_key_cache_size', 10000))
+def sort_key(s: str, language: str = None) -> tuple:
+    """Get collation sort key of a string
+    """
+    return get_collator(language).sort_key(s if s is not None else '')
+
+
+def sort_entities(entities: Iterable[odm.Entity], field: str, order: int = odm.I_ASC) -> List[odm.Entity]:
+    """Sort entities by a string field according to collation rules of current language
+    """
+    language = lang.get_current()
+
+    return sorted(entities, key=lambda e: sort_key(e.f_get(field), language), reverse=order == odm.I_DESC)
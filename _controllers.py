@@ -4,9 +4,10 @@ __author__ = 'Oleksandr Shepetko'
 __email__ = 'a@shepetko.com'
 __license__ = 'MIT'
 
-from pytsite import tpl, router, routing, errors, metatag
-from plugins import admin
-from . import _api
+from pytsite import tpl, router, routing, errors, metatag, http, reg
+from plugins import admin, odm_auth
+from plugins.odm_auth import PERM_CREATE, PERM_MODIFY, PERM_DELETE, PERM_MODIFY_OWN, PERM_DELETE_OWN
+from . import _api, _metrics, _changes, _broker
 
 
 class Browse(routing.Controller):
@@ -48,6 +49,8 @@ class Form(routing.Controller):
         rule_name = self.arg('_pytsite_router_rule_name')  # type: str
         model = self.arg('model')
 
+        _metrics.set_endpoint(rule_name)
+
         # Get form
         if rule_name.endswith('m_form'):
             try:
@@ -58,7 +61,7 @@ class Form(routing.Controller):
                 raise self.not_found(e)
         elif rule_name.endswith('d_form'):
             eids = self.arg('ids', []) or self.arg('eids', [])
-            form = _api.get_d_form(model, eids, hide_title=True)
+            form = _api.get_d_form(model, eids, query=self.arg('query'), hide_title=True)
         else:
             raise self.not_found()
 
@@ -78,3 +81,38 @@ class Form(routing.Controller):
             except routing.error.RuleNotFound:
                 # Render a template provided by application
                 return tpl.render('odm_ui/form', {'form': form})
+
+
+class BrowserEvents(routing.Controller):
+    """Entities Browser Server-Sent Events Stream
+    """
+
+    def exec(self) -> http.Response:
+        model = self.arg('model')
+
+        if not odm_auth.check_model_permissions(model, [PERM_CREATE, PERM_MODIFY, PERM_DELETE,
+                                                        PERM_MODIFY_OWN, PERM_DELETE_OWN]):
+            raise self.forbidden()
+
+        keepalive = reg.get('odm_ui.browser_events_keepalive', 15)
+        lifetime = reg.get('odm_ui.browser_events_lifetime', 300)
+        subscription = _broker.subscribe(_changes.get_channel(model))
+
+        def stream():
+            try:
+                yield 'retry: 5000\n\n'
+
+                # Stream is closed periodically to release the worker, clients reconnect automatically
+                for _ in range(max(1, lifetime // keepalive)):
+                    # Only a notification is sent, changed rows are pulled through the delta endpoint, which
+                    # shows the user only entities visible to them
+                    if subscription.get(keepalive):
+                        yield 'data: changed\n\n'
+                    else:
+                        yield ': keepalive\n\n'
+            finally:
+                subscription.close()
+
+        router.no_cache(True)
+
+        return http.Response(stream(), content_type='text/event-stream', headers={'X-Accel-Buffering': 'no'})
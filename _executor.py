@@ -0,0 +1,62 @@
+"""PytSite Object Document Mapper UI Plugin Executor
+"""
+__author__ = 'Oleksandr Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+from typing import Callable, Dict, Optional
+from concurrent.futures import ThreadPoolExecutor, Future
+from threading import Lock
+from pytsite import reg, lang, router, http
+from plugins import auth
+from . import _metrics
+
+_executors = {}  # type: Dict[str, ThreadPoolExecutor]
+_executors_lock = Lock()
+
+
+def _get_executor(name: str = 'odm_ui', max_workers_reg_key: str = 'odm_ui.executor_max_workers') -> ThreadPoolExecutor:
+    if name not in _executors:
+        with _executors_lock:
+            if name not in _executors:
+                _executors[name] = ThreadPoolExecutor(reg.get(max_workers_reg_key, 8), name)
+
+    return _executors[name]
+
+
+def _run(fn: Callable, language: str, user: auth.model.AbstractUser, request: Optional[http.Request],
+         scope: Optional[_metrics.Scope], *args, **kwargs):
+    # Language, current user and request are thread bound, so they must be restored in the worker thread.
+    # Session is not available in the worker thread, functions which need it must get it as an argument.
+    lang.set_current(language)
+    auth.switch_user(user)
+    router.set_request(request)
+
+    # Queries are accounted to the request which submitted the function
+    _metrics.set_scope(scope)
+
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        _metrics.set_scope(None)
+        router.set_request(None)
+        auth.restore_user()
+
+
+def submit(fn: Callable, *args, **kwargs) -> Future:
+    """Run a function in the plugin's thread pool on behalf of current language, user and request
+    """
+    return _get_executor().submit(_run, fn, lang.get_current(), auth.get_current_user(), router.request(),
+                                  _metrics.get_scope(), *args, **kwargs)
+
+
+def submit_controller(fn: Callable, request: Optional[http.Request], *args, **kwargs) -> Future:
+    """Run a controller on behalf of a request in a separate thread pool
+
+    Controllers submit their own functions to the plugin's thread pool and wait for them, so running them in the same
+    pool could exhaust it with waiting workers.
+    """
+    executor = _get_executor('odm_ui_aio', 'odm_ui.aio_executor_max_workers')
+
+    return executor.submit(_run, fn, lang.get_current(), auth.get_current_user(), request, _metrics.get_scope(),
+                           *args, **kwargs)
@@ -0,0 +1,72 @@
+"""PytSite Object Document Mapper UI Plugin Fields Widgets Registry
+"""
+__author__ = 'Oleksandr Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+from typing import Callable, Dict, List, Optional, Tuple, Type
+from plugins import widget, odm
+
+_registry = {}  # type: Dict[Type[odm.field.Abstract], Tuple[Type[widget.Abstract], Optional[Callable]]]
+_schemas = {}  # type: Dict[str, List[Tuple[str, Type[widget.Abstract], dict]]]
+
+
+def register(field_class: Type[odm.field.Abstract], widget_class: Type[widget.Abstract],
+             kwargs_builder: Callable[[odm.field.Abstract], dict] = None):
+    """Register a widget class to be used in modify forms for fields of a class
+
+    `kwargs_builder` gets a field and returns additional static widget's constructor arguments. If the arguments
+    contain `items`, every item gets translated by the entity on form building.
+    """
+    _registry[field_class] = (widget_class, kwargs_builder)
+
+    # Previously compiled schemas are not valid anymore
+    _schemas.clear()
+
+
+def _resolve(field: odm.field.Abstract) -> Optional[Tuple[Type[widget.Abstract], Optional[Callable]]]:
+    # The most specific registered field class wins
+    for cls in type(field).__mro__:
+        if cls in _registry:
+            return _registry[cls]
+
+
+def get_schema(entity: odm.Entity) -> List[Tuple[str, Type[widget.Abstract], dict]]:
+    """Get compiled modify form schema of entity's model
+
+    Schema is a list of (field uid, widget class, static widget's constructor arguments), it is built once per model.
+    """
+    schema = _schemas.get(entity.model)
+    if schema is not None:
+        return schema
+
+    schema = []
+    weight = 0
+    for uid, field in entity.fields.items():
+        if uid.startswith('_') or field is None:
+            continue
+
+        weight += 10
+
+        resolved = _resolve(field)
+        if not resolved:
+            continue
+
+        widget_class, kwargs_builder = resolved
+        kwargs = {'weight': weight, 'required': field.is_required}
+        if kwargs_builder:
+            kwargs.update(kwargs_builder(field))
+
+        schema.append((uid, widget_class, kwargs))
+
+    _schemas[entity.model] = schema
+
+    return schema
+
+
+register(odm.field.Bool, widget.select.Checkbox)
+register(odm.field.Integer, widget.input.Integer)
+register(odm.field.Decimal, widget.input.Decimal)
+register(odm.field.Email, widget.input.Email)
+register(odm.field.String, widget.input.Text)
+register(odm.field.Enum, widget.select.Select, lambda field: {'items': tuple(field.values)})
@@ -5,10 +5,14 @@ __email__ = 'a@shepetko.com'
 __license__ = 'MIT'
 
 import htmler
-from pytsite import lang, http, events, router, logger, errors
+import json
+from typing import Iterator
+from itertools import islice
+from bson import ObjectId
+from pytsite import lang, http, events, router, logger, errors, reg
 from plugins import widget, form, odm, odm_auth
 from plugins.odm_auth import PERM_CREATE, PERM_MODIFY, PERM_DELETE
-from . import _model
+from . import _model, _metrics
 
 
 class Modify(form.Form):
@@ -48,8 +52,9 @@ class Modify(form.Form):
             self.title = entity.t('odm_ui_form_title_modify_' + model)
 
         # Setting up the form through entity hook and global event
-        entity.odm_ui_m_form_setup(self)
-        events.fire('odm_ui@m_form_setup.{}'.format(model), frm=self, entity=entity)
+        with _metrics.phase('m_form_setup'):
+            entity.odm_ui_m_form_setup(self)
+            events.fire('odm_ui@m_form_setup.{}'.format(model), frm=self, entity=entity)
 
         # Redirect
         if not self.redirect:
@@ -66,8 +71,9 @@ class Modify(form.Form):
 
         # Setting up form's widgets through entity hook and global event
         entity = dispense_entity(model, eid)
-        entity.odm_ui_m_form_setup_widgets(self)
-        events.fire('odm_ui@m_form_setup_widgets.{}'.format(model), frm=self, entity=entity)
+        with _metrics.phase('m_form_setup_widgets'):
+            entity.odm_ui_m_form_setup_widgets(self)
+            events.fire('odm_ui@m_form_setup_widgets.{}'.format(model), frm=self, entity=entity)
 
         if self.current_step == 1:
             # Entity model
@@ -115,7 +121,8 @@ class Modify(form.Form):
         # Ask entity to validate the form
         from ._api import dispense_entity
 
-        dispense_entity(self.attr('model'), self.attr('eid')).odm_ui_m_form_validate(self)
+        with _metrics.phase('m_form_validate'):
+            dispense_entity(self.attr('model'), self.attr('eid')).odm_ui_m_form_validate(self)
 
     def _on_submit(self):
         from ._api import dispense_entity
@@ -125,7 +132,8 @@ class Modify(form.Form):
 
         # Fill entity fields
         try:
-            entity.odm_ui_m_form_submit(self)
+            with _metrics.phase('m_form_submit'):
+                entity.odm_ui_m_form_submit(self)
         except Exception as e:
             router.session().add_error_message(str(e))
             raise e
@@ -152,24 +160,83 @@ class MassAction(form.Form):
         if isinstance(eids, str):
             self.set_attr('eids', eids.split(','))
 
+        # Entities may be selected by browser's query instead of explicit IDs
+        query = self.attr('query')
+        if isinstance(query, str):
+            self.set_attr('query', json.loads(query) if query else None)
+
         if not self.redirect:
             from ._api import get_model_class
             self.redirect = router.rule_url(get_model_class(model).odm_ui_browse_rule(), {'model': model})
 
         self.css += ' odm-ui-mass-action-form'
 
+    def get_entities(self) -> Iterator[odm.Entity]:
+        """Iterate over entities to process
+
+        Entities selected by query are loaded in batches of `odm_ui.mass_action_batch_size` entities.
+        """
+        from ._api import dispense_entity, get_browser
+
+        model = self.attr('model')
+        query = self.attr('query')
+
+        if query is None:
+            eids = list(self.attr('eids', self.attr('ids', [])))
+            batch_size = reg.get('odm_ui.mass_action_batch_size', 500)
+            for i in range(0, len(eids), batch_size):
+                batch = eids[i:i + batch_size]
+                for eid in batch:
+                    if not ObjectId.is_valid(eid):
+                        raise odm.error.EntityNotFound(model, eid)
+
+                found = {str(e.id): e for e in odm.find(model).inc('_id', [ObjectId(eid) for eid in batch]).get()}
+                for eid in batch:
+                    yield found[eid] if eid in found else dispense_entity(model, eid)
+            return
+
+        # Batches are paginated by ID, so processed entities may be changed or deleted without shifting next batches
+        browser = get_browser(model)
+        batch_size = reg.get('odm_ui.mass_action_batch_size', 500)
+        last_id = None
+        while True:
+            finder = browser.get_finder(query).sort([('_id', odm.I_ASC)])
+            if last_id:
+                finder.gt('_id', last_id)
+
+            batch = list(finder.get(batch_size))
+            if not batch:
+                return
+
+            yield from batch
+            last_id = batch[-1].id
+
     def _on_setup_widgets(self):
         """Hook.
         """
-        from ._api import dispense_entity
+        from ._api import dispense_entity, get_browser
+
+        model = self.attr('model')
+        query = self.attr('query')
 
         # List of items to process
         ol = htmler.Ol()
-        for eid in self.attr('eids', self.attr('ids', [])):
-            entity = dispense_entity(self.attr('model'), eid)
-            self.add_widget(widget.input.Hidden(uid='eids-' + eid, name='eids', value=eid))
-            ol.append_child(htmler.Li(entity.odm_ui_mass_action_entity_description()))
-        self.add_widget(widget.static.HTML(uid='eids-text', em=ol))
+        if query is None:
+            for eid in self.attr('eids', self.attr('ids', [])):
+                entity = dispense_entity(model, eid)
+                self.add_widget(widget.input.Hidden(uid='eids-' + eid, name='eids', value=eid))
+                ol.append_child(htmler.Li(entity.odm_ui_mass_action_entity_description()))
+            self.add_widget(widget.static.HTML(uid='eids-text', em=ol))
+        else:
+            # Only number of matching entities and a sample of them are shown
+            finder = get_browser(model).get_finder(query)
+            count = finder.count()
+            for entity in finder.get(reg.get('odm_ui.mass_action_sample_size', 10)):
+                ol.append_child(htmler.Li(entity.odm_ui_mass_action_entity_description()))
+            self.add_widget(widget.input.Hidden(uid='query', value=json.dumps(query)))
+            self.add_widget(widget.static.Text(uid='eids-count', title=lang.t('odm_ui@entities_matching_query'),
+                                               text=str(count)))
+            self.add_widget(widget.static.HTML(uid='eids-text', em=ol))
 
         # Submit button
         submit_button = self.get_widget('action_submit')  # type: widget.button.Submit
@@ -201,7 +268,7 @@ class Delete(MassAction):
         if not self.name:
             self.name = 'odm_ui_delete_' + model
 
-        # Check permissions
+        # Check permissions. Entities selected by query are checked while processing.
         for eid in self.attr('eids', self.attr('ids', [])):
             e = odm.dispense(model, eid)  # type: odm_auth.OwnedEntity
             if not e.odm_auth_check_entity_permissions(PERM_DELETE):
@@ -222,15 +289,30 @@ class Delete(MassAction):
         # Change submit button color
         self.get_widget('action_submit').color = 'danger'
 
-    def _on_submit(self):
-        from ._api import dispense_entity
+    def delete_entities(self):
+        """Delete entities in batches
 
-        model = self.attr('model')
+        Batches are passed to `UIEntity.odm_ui_d_form_submit_bulk()`.
+        """
+        with _metrics.phase('d_form_submit'):
+            model_class = odm.get_model_class(self.attr('model'))  # type: _model.UIEntity
+            batch_size = reg.get('odm_ui.mass_action_batch_size', 500)
+            entities = iter(self.get_entities())
+            while True:
+                batch = list(islice(entities, batch_size))
+                if not batch:
+                    break
+
+                for entity in batch:
+                    if not entity.odm_auth_check_entity_permissions(PERM_DELETE):
+                        raise http.error.Forbidden()
+
+                model_class.odm_ui_d_form_submit_bulk(batch)
 
+    def _on_submit(self):
         try:
             # Ask entities to process deletion
-            for eid in self.attr('eids', self.attr('ids', [])):
-                dispense_entity(model, eid).odm_ui_d_form_submit()
+            self.delete_entities()
 
             router.session().add_info_message(lang.t('odm_ui@operation_successful'))
 
@@ -4,13 +4,39 @@ __author__ = 'Oleksandr Shepetko'
 __email__ = 'a@shepetko.com'
 __license__ = 'MIT'
 
-from typing import Union, Iterable
-from pyuca import Collator
-from pytsite import routing, formatters, validation
-from plugins import odm, http_api
-from . import _browser, _model
+import gzip
+import heapq
+import hashlib
+import json
+import threading
+from datetime import datetime
+from typing import Union, Iterable, Iterator, List, Optional, Tuple
+from collections import OrderedDict
+from itertools import chain, islice
+from pymongo.errors import ExecutionTimeout
+from pytsite import routing, formatters, validation, http, reg, lang
+from plugins import odm, auth, odm_http_api
+from plugins.odm_auth import PERM_VIEW
+from . import _api, _browser, _changes, _collation, _model, _executor, _metrics, _profiler, \
+    _single_flight
+
+
+_local = threading.local()
+
+
+def on_pre_dispatch():
+    """pytsite.router@pre_dispatch event handler
+    """
+    _local.private_cache = False
+
 
-_pyuca_col = Collator()
+def on_response(response: http.Response):
+    """pytsite.router@response event handler
+    """
+    # Router marks all GET responses as public after controller returns, so header is replaced here
+    if getattr(_local, 'private_cache', False):
+        response.headers.set('Cache-Control', 'private, no-cache')
+        _local.private_cache = False
 
 
 class GetBrowserRows(routing.Controller):
@@ -23,9 +49,13 @@ class GetBrowserRows(routing.Controller):
         self.args.add_formatter('offset', formatters.PositiveInt())
         self.args.add_formatter('limit', formatters.PositiveInt())
         self.args.add_formatter('search', formatters.Str(max_len=64))
+        self.args.add_formatter('total', formatters.PositiveInt(), False)
+        self.args.add_formatter('count_token', formatters.Str(max_len=32), False)
         self.args.add_validation('order', validation.rule.Enum(values=['asc', 'desc']))
 
     def exec(self) -> Union:
+        _metrics.set_endpoint('odm_ui@get_browser_rows')
+
         browser = _browser.Browser(
             model=self.arg('model'),
             browse_rule=self.arg('browse_rule'),
@@ -33,20 +63,109 @@ class GetBrowserRows(routing.Controller):
             d_form_rule=self.arg('d_form_rule'),
         )
 
-        r = browser.get_rows(self.args)
+        # Compression is negotiated
+        gzipped = bool(reg.get('odm_ui.browser_rows_gzip', True) and 'gzip' in self.request.accept_encodings)
 
-        if r['total'] and not r['rows']:
-            offset = self.arg('offset') - self.arg('limit')
-            if offset < 0:
-                offset = 0
+        # Rows depend only on the model's data, request arguments, user and language
+        etag = hashlib.md5(json.dumps([
+            browser.model,
+            self.arg('parent'),
+            _changes.get_version(browser.model),
+            sorted((k, v) for k, v in self.request.inp.items() if k != '_'),  # Skip cache busting argument
+            auth.get_current_user().uid,
+            lang.get_current(),
+        ], default=str).encode()).hexdigest()
+        if gzipped:
+            etag += '-gzip'
 
-            r_args = self.request.inp
-            r_args['model'] = browser.model
-            r_args['offset'] = offset
+        # Rows are specific to the user, so they must not be stored by shared caches
+        _local.private_cache = True
 
-            return self.redirect(http_api.url('odm_ui@get_browser_rows', r_args))
+        if self.request.if_none_match.contains(etag):
+            return http.Response(status=304, headers={'ETag': '"{}"'.format(etag)})
+
+        def get_rows() -> dict:
+            # Token must be taken before querying to not miss changes made during it
+            sync_token = _changes.get_sync_token(browser.model)
+
+            rows = browser.get_rows(self.args)
+            rows['sync_token'] = sync_token
+
+            return rows
+
+        # Identical concurrent requests share a single query
+        r = _single_flight.do(etag, get_rows)
+
+        # Incomplete results must not be revalidated until entities are changed
+        headers = {'Vary': 'Accept-Encoding'}
+        if not (r.get('timeout') or r.get('total_estimated')):
+            headers['ETag'] = '"{}"'.format(etag)
+        body = json.dumps(r, separators=(',', ':'), default=str).encode()
+        if gzipped and len(body) >= reg.get('odm_ui.browser_rows_gzip_min_size', 1024):
+            body = gzip.compress(body, reg.get('odm_ui.browser_rows_gzip_level', 6))
+            headers['Content-Encoding'] = 'gzip'
+
+        return http.Response(body, content_type='application/json', headers=headers)
 
-        return r
+
+class GetBrowserRowsDelta(routing.Controller):
+    """Get browser rows changed since a sync token
+    """
+
+    def __init__(self):
+        super().__init__()
+
+        self.args.add_formatter('since', formatters.Int())
+        self.args.add_formatter('search', formatters.Str(max_len=64))
+        self.args.add_validation('order', validation.rule.Enum(values=['asc', 'desc']))
+
+    def exec(self) -> dict:
+        _metrics.set_endpoint('odm_ui@get_browser_rows_delta')
+
+        browser = _browser.Browser(
+            model=self.arg('model'),
+            browse_rule=self.arg('browse_rule'),
+            m_form_rule=self.arg('m_form_rule'),
+            d_form_rule=self.arg('d_form_rule'),
+        )
+
+        since = self.arg('since')
+        changes = _changes.get_changes(browser.model, since)
+        if changes is None:
+            return {'reset': True, 'token': _changes.get_sync_token(browser.model), 'rows': [], 'inserted': [],
+                    'removed': []}
+
+        # Only the latest operation on each entity matters, but entity created within the period stays inserted
+        last_ops = OrderedDict()
+        inserted = set()
+        for seq, eid, op in sorted(changes):
+            last_ops.pop(eid, None)
+            last_ops[eid] = op
+            if op == 'insert':
+                inserted.add(eid)
+
+        saved = [eid for eid, op in last_ops.items() if op in ('save', 'insert')]
+        rows = browser.get_rows_by_ids(self.args, saved) if saved else []
+
+        # Entities which were deleted or do not match the query anymore
+        matched = {row['__id'] for row in rows}
+        removed = [eid for eid in last_ops if eid not in matched]
+
+        # Sequence number is taken before the change is logged, so a lower number may be logged later than a higher
+        # one. Token is advanced only over contiguous numbers, changes after a gap are sent again next time.
+        token = since
+        for seq in sorted(c[0] for c in changes):
+            if seq != token + 1:
+                break
+            token = seq
+
+        return {
+            'reset': False,
+            'token': token,
+            'rows': rows,
+            'inserted': [eid for eid in saved if eid in inserted and eid in matched],
+            'removed': removed,
+        }
 
 
 class PutBrowserRows(routing.Controller):
@@ -56,23 +175,45 @@ class PutBrowserRows(routing.Controller):
         self.args.add_formatter('rows', formatters.JSONArray())
 
     def exec(self):
+        _metrics.set_endpoint('odm_ui@put_browser_rows')
+
         model = self.arg('model')
 
-        for row in self.arg('rows'):
-            e = odm.dispense(model, row['__id'])
-            e.f_set_multiple({
-                '_parent': odm.dispense(model, row['__parent']) if row['__parent'] else None,
-                'order': row['order'],
-            })
-            e.save()
+        with _metrics.phase('save'):
+            for row in self.arg('rows'):
+                e = odm.dispense(model, row['__id'])
+                e.f_set_multiple({
+                    '_parent': odm.dispense(model, row['__parent']) if row['__parent'] else None,
+                    'order': row['order'],
+                })
+                e.save()
 
         return {'status': True}
 
 
+def _merge_key(v, language: str) -> tuple:
+    """Get a key to compare field values of different types, ordered by type the same way as by MongoDB
+    """
+    if v is None:
+        return 0,
+    if isinstance(v, bool):
+        return 7, v
+    if isinstance(v, (int, float)):
+        return 1, v
+    if isinstance(v, str):
+        return 2, _collation.sort_key(v, language)
+    if isinstance(v, datetime):
+        return 8, v
+
+    return 9, str(v)
+
+
 class GetWidgetEntitySelect(routing.Controller):
     def __init__(self):
         super().__init__()
 
+        self._timed_out = False
+
         self.args.add_formatter('model', formatters.JSONArray())
         self.args.add_formatter('sort_by', formatters.Str(max_len=32))
         self.args.add_formatter('limit', formatters.PositiveInt(10, 100))
@@ -86,14 +227,53 @@ class GetWidgetEntitySelect(routing.Controller):
         self.args.add_formatter('sort_order', formatters.Enum(1, (-1, 1)))
 
     @staticmethod
-    def _find_entities(args: dict) -> Iterable[_model.UIEntity]:
-        models = args['model']
+    def _iter_entities(f: odm.MultiModelFinder, models: List[str], args: dict) -> Iterator[_model.UIEntity]:
+        """Iterate over found entities
+
+        If time budget is set, IDs are selected by a raw query which is aborted by the database server after
+        `odm_ui.select_time_budget` milliseconds with pymongo.errors.ExecutionTimeout.
+        """
+        time_budget = reg.get('odm_ui.select_time_budget', 0)
+        if not time_budget:
+            yield from f.get()
+            return
+
+        query = f.query.compile()
+        query['_model'] = {'$in': models}
+        projection = {'_id': 1}
+        sort = [(args['sort_by'], args['sort_order'])] if args['sort_by'] else None
+
+        # Results of text search are ordered by relevance unless explicit sort is requested, the same as by finder
+        if '$text' in query:
+            projection['_score'] = {'$meta': 'textScore'}
+            sort = sort or [('_score', {'$meta': 'textScore'})]
+
+        batch_size = args['limit'] + 1
+        cursor = _api.get_mock(models[0]).collection.find(query, projection, sort=sort, batch_size=batch_size)
+
+        ids = []
+        for doc in cursor.max_time_ms(time_budget):
+            ids.append(doc['_id'])
+            if len(ids) == batch_size:
+                found = {e.id: e for e in odm.mfind(models).inc('_id', ids).get()}
+                yield from (found[i] for i in ids if i in found)
+                ids = []
+
+        if ids:
+            found = {e.id: e for e in odm.mfind(models).inc('_id', ids).get()}
+            yield from (found[i] for i in ids if i in found)
+
+    @classmethod
+    def _collect_entities(cls, models: List[str], args: dict) -> Tuple[List[_model.UIEntity], bool]:
+        """Collect visible entities of models stored in the same collection
+
+        Returns entities and whether the query was aborted by time budget.
+        """
         sort_by = args['sort_by']
-        sort_order = args['sort_order']
         f = odm.mfind(models)
 
         if sort_by:
-            f.sort([(sort_by, sort_order)])
+            f.sort([(sort_by, args['sort_order'])])
 
         exclude = args.get('exclude')
         if exclude:
@@ -101,34 +281,89 @@ class GetWidgetEntitySelect(routing.Controller):
 
         # Let model's class adjust finder
         for model in models:
-            mock = odm.dispense(model)  # type: _model.UIEntity
-            mock.odm_ui_widget_select_search_entities(f, args)
+            _api.get_mock(model).odm_ui_widget_select_search_entities(f, args)
 
-        # Collect entities
+        # Collect entities, results of a slow query found in time are still useful
         entities = []
-        for entity in f.get():  # type:  _model.UIEntity
-            if entity.odm_ui_widget_select_search_entities_is_visible(args):
-                entities.append(entity)
-            if len(entities) - 1 == args['limit']:
-                break
+        try:
+            for entity in cls._iter_entities(f, models, args):  # type:  _model.UIEntity
+                if entity.odm_ui_widget_select_search_entities_is_visible(args):
+                    entities.append(entity)
+                if len(entities) - 1 == args['limit']:
+                    break
+        except ExecutionTimeout:
+            return entities, True
+
+        return entities, False
+
+    def _find_entities(self, args: dict) -> Iterable[_model.UIEntity]:
+        models = args['model']
+        sort_by = args['sort_by']
+        sort_order = args['sort_order']
+
+        # Group models by collections they are stored in
+        collections = OrderedDict()
+        for model in models:
+            collections.setdefault(_api.get_mock(model).collection.name, []).append(model)
+
+        if len(collections) > 1:
+            # Query each collection concurrently and merge already sorted results
+            futures = [_executor.submit(self._collect_entities, c_models, args) for c_models in collections.values()]
+            collected = [future.result() for future in futures]
+            self._timed_out = any(timed_out for _, timed_out in collected)
+
+            results = [entities for entities, _ in collected]
+            if sort_by:
+                language = lang.get_current()
+                reverse = sort_order == odm.I_DESC
+
+                def key(e: _model.UIEntity):
+                    return _merge_key(e.f_get(sort_by), language)
+
+                # Inputs are re-sorted by the same key, because database orders strings differently than collator
+                results = [sorted(entities, key=key, reverse=reverse) for entities in results]
+                merged = heapq.merge(*results, key=key, reverse=reverse)
+            else:
+                merged = chain(*results)
+
+            entities = list(islice(merged, args['limit'] + 1))
+        else:
+            entities, self._timed_out = self._collect_entities(models, args)
 
         # Do additional sorting, because MongoDB does not sort all languages properly
         if entities and sort_by and isinstance(entities[0].get_field(sort_by), odm.field.String):
-            entities = sorted(entities, key=lambda e: _pyuca_col.sort_key(e.f_get(sort_by)),
-                              reverse=sort_order == odm.I_DESC)
+            entities = _collation.sort_entities(entities, sort_by, sort_order)
 
         return entities
 
     def _build_entities_flat_tree(self, args: dict) -> Iterable[_model.UIEntity]:
         r = []
-
-        for entity in self._find_entities(args):
+        entities = self._find_entities(args)
+
+        # Load ancestors of all found entities with a single query if their models store materialized paths
+        ancestors = {}
+        refs = set()
+        for entity in entities:
+            if entity.odm_ui_materialized_path_enabled():
+                refs.update(entity.f_get('_ancestors'))
+        if refs:
+            ancestors = {e.ref: e for e in odm.mfind(args['model']).inc('_ref', list(refs)).get()}
+
+        def parent_of(e: _model.UIEntity) -> Optional[_model.UIEntity]:
+            if e.odm_ui_materialized_path_enabled():
+                path = e.f_get('_ancestors')
+                return ancestors.get(path[-1]) if path else None
+
+            return e.parent
+
+        for entity in entities:
+            parent = parent_of(entity)
             if entity not in r:
                 # If parent of current entity is already appended
-                if entity.parent and entity.parent in r:
+                if parent and parent in r:
                     # Skip all children after that parent
-                    i = r.index(entity.parent) + 1
-                    while i < len(r) and r[i].parent == entity.parent:
+                    i = r.index(parent) + 1
+                    while i < len(r) and parent_of(r[i]) == parent:
                         i += 1
 
                     r.insert(i, entity)
@@ -137,20 +372,103 @@ class GetWidgetEntitySelect(routing.Controller):
 
             # Insert entity's parents
             cur_entity = entity
-            while cur_entity.parent and cur_entity.parent not in r:
-                r.insert(r.index(cur_entity), cur_entity.parent)
-                cur_entity = cur_entity.parent
+            cur_parent = parent
+            while cur_parent and cur_parent not in r:
+                r.insert(r.index(cur_entity), cur_parent)
+                cur_entity = cur_parent
+                cur_parent = parent_of(cur_entity)
 
         return r
 
     def exec(self) -> dict:
+        _metrics.set_endpoint('odm_ui@widget_entity_select')
+
+        # Identical concurrent requests share a single query
+        key = _single_flight.make_key('widget_entity_select', sorted(
+            (k, v) for k, v in self.args.items() if k != '_'))
+
+        return _single_flight.do(key, self._get_results)
+
+    def _get_results(self) -> dict:
+        with _metrics.phase('find'):
+            entities = self._build_entities_flat_tree(self.args)
+
         items = []
-        for entity in self._build_entities_flat_tree(self.args):
-            # Title
-            title = entity.odm_ui_widget_select_search_entities_title(self.args)
-            if entity.depth:
-                title = '{} {}'.format(self.arg('depth_indent') * entity.depth, title)
+        with _metrics.phase('titles'):
+            for entity in entities:
+                # Title
+                title = entity.odm_ui_widget_select_search_entities_title(self.args)
+                if entity.odm_ui_depth:
+                    title = '{} {}'.format(self.arg('depth_indent') * entity.odm_ui_depth, title)
+
+                items.append({'id': entity.ref, 'text': title})
 
-            items.append({'id': entity.ref, 'text': title})
+        # Let user know that the list is incomplete
+        if self._timed_out:
+            items.append({'id': '', 'text': lang.t('odm_ui@refine_search'), 'disabled': True})
 
         return {'results': items}
+
+
+class GetEntities(routing.Controller):
+    """Get projected fields of multiple entities by their references
+    """
+
+    def __init__(self):
+        super().__init__()
+
+        self.args.add_formatter('refs', formatters.JSONArray())
+        self.args.add_formatter('fields', formatters.JSONArray())
+        self.args.add_formatter('sort_by', formatters.Str(max_len=32))
+
+        self.args.add_formatter('sort_order', formatters.Str(lower=True))
+        self.args.add_formatter('sort_order', formatters.Transform(1, {'asc': 1, 'desc': -1}))
+        self.args.add_formatter('sort_order', formatters.Int(1, -1, 1))
+        self.args.add_formatter('sort_order', formatters.Enum(1, (-1, 1)))
+
+    def exec(self) -> list:
+        model = self.arg('model')
+
+        model_cls = odm.get_model_class(model)
+        if not (issubclass(model_cls, odm_http_api.HTTPAPIEntityMixin) and model_cls.odm_http_api_enabled()):
+            raise self.forbidden("Model '{}' does not support transfer via HTTP API".format(model))
+
+        refs = self.arg('refs')[:reg.get('odm_ui.entities_batch_size', 100)]
+        if not refs:
+            return []
+
+        f = odm.find(model).inc('_ref', refs)
+        sort_by = self.arg('sort_by')
+        if sort_by:
+            f.sort([(sort_by, self.arg('sort_order'))])
+
+        # Entities are loaded entirely, because permission checks and JSON fields may depend on any stored field,
+        # so only the response is reduced to requested fields
+        r = []
+        for entity in f.get():
+            if not entity.odm_auth_check_entity_permissions(PERM_VIEW):
+                continue
+
+            jsonable = entity.as_jsonable()
+            item = {'ref': entity.ref}
+            for field in self.arg('fields'):
+                if field in jsonable:
+                    item[field] = jsonable[field]
+            r.append(item)
+
+        # Keep requested order
+        if not sort_by:
+            r.sort(key=lambda item: refs.index(item['ref']))
+
+        return r
+
+
+class GetMetrics(routing.Controller):
+    """Get collected metrics in Prometheus text exposition format
+    """
+
+    def exec(self) -> http.Response:
+        if self.request.real_remote_addr not in reg.get('odm_ui.metrics_allowed_addrs', ('127.0.0.1', '::1')):
+            raise self.forbidden()
+
+        return http.Response(_metrics.render() + _profiler.render(), content_type='text/plain; version=0.0.4')
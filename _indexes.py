@@ -0,0 +1,225 @@
+"""PytSite Object Document Mapper UI Plugin Index Advisor
+"""
+__author__ = 'Oleksandr Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+from typing import Dict, List, Tuple
+from concurrent.futures import Future
+from threading import Lock
+from werkzeug.test import EnvironBuilder
+from pytsite import console, cache, reg, logger, router, http
+from plugins import odm, auth
+from . import _executor
+
+IndexKeys = List[Tuple[str, int]]
+
+_cache_pool = cache.create_pool('odm_ui@indexes')
+_used_sorts = {}  # type: Dict[str, set]
+_ensured = set()
+_lock = Lock()
+
+
+def _sortable_fields(browser) -> List[str]:
+    r = []
+    mock = odm.dispense(browser.model)
+
+    for data_field in browser.data_fields:
+        if isinstance(data_field, str):
+            name, sortable = data_field, True
+        else:
+            name, sortable = data_field[0], data_field[2] if len(data_field) > 2 else True
+
+        if sortable and mock.has_field(name) and name not in r:
+            r.append(name)
+
+    return r
+
+
+def _get_used_sorts(model: str) -> set:
+    if model not in _used_sorts:
+        try:
+            _used_sorts[model] = {(k.split(':')[0], int(k.split(':')[1])) for k in
+                                  _cache_pool.get_hash('sorts.' + model).keys()}
+        except cache.error.KeyNotExist:
+            _used_sorts[model] = set()
+
+    return _used_sorts[model]
+
+
+def use_sort(browser, field: str, order: int):
+    """Remember that entities browser was sorted by a field chosen by user
+
+    Indexes are advised only for the default sort field and fields which were actually used for sorting.
+    """
+    if (field, order) in _get_used_sorts(browser.model) or field not in _sortable_fields(browser):
+        return
+
+    with _lock:
+        _get_used_sorts(browser.model).add((field, order))
+
+    _cache_pool.put_hash_item('sorts.' + browser.model, '{}:{}'.format(field, order), 1)
+    ensure(browser)
+
+
+def _sorts(browser) -> List[Tuple[str, int]]:
+    r = []
+    mock = odm.dispense(browser.model)
+
+    default = browser.default_sort_field
+    if default and mock.has_field(default):
+        r.append((default, odm.I_DESC if browser.default_sort_order in (-1, 'desc') else odm.I_ASC))
+
+    sortable = _sortable_fields(browser)
+    for field, order in sorted(_get_used_sorts(browser.model)):
+        (field, order) not in r and field in sortable and r.append((field, order))
+
+    return r
+
+
+def advise(browser, owner_scoped: bool = None) -> List[IndexKeys]:
+    """Get compound indexes required by entities browser to sort and filter without in-memory sorting
+
+    Equality filters, i.e. parent in tree mode and author if user is allowed to browse own entities only, go first,
+    sort keys go next. If `owner_scoped` is not specified, it is checked for current user.
+    """
+    r = []
+    mock = odm.dispense(browser.model)
+    tree_mode = mock.odm_ui_browser_tree_mode()
+
+    if owner_scoped is None:
+        owner_scoped = browser.is_owner_scoped()
+    prefix = [('author', odm.I_ASC)] if owner_scoped and mock.has_field('author') else []
+
+    for field, order in _sorts(browser):
+        # Index can be traversed in both directions after equality prefix, so sort order matters only if root
+        # elements are sorted first
+        keys = prefix + [('_parent', odm.I_ASC), (field, odm.I_ASC if tree_mode else order)]
+        keys not in r and r.append(keys)
+
+    return r
+
+
+def _covers(existing: IndexKeys, required: IndexKeys) -> bool:
+    if len(existing) < len(required):
+        return False
+
+    prefix = existing[:len(required)]
+
+    return prefix == required or prefix == [(k, -d) for k, d in required]
+
+
+def _index_keys(info: dict) -> IndexKeys:
+    r = []
+
+    # Keys of text, geospatial and hashed indexes cannot serve sorting, so neither can keys following them
+    for k, d in info['key']:
+        if not isinstance(d, (int, float)):
+            break
+        r.append((k, int(d)))
+
+    return r
+
+
+def get_missing(browser, owner_scoped: bool = None) -> List[IndexKeys]:
+    """Get compound indexes required by entities browser which do not exist yet
+    """
+    existing = [_index_keys(info) for info in odm.dispense(browser.model).collection.index_information().values()]
+
+    return [keys for keys in advise(browser, owner_scoped) if not any(_covers(e, keys) for e in existing)]
+
+
+def create_missing(browser, owner_scoped: bool = None) -> List[IndexKeys]:
+    """Create compound indexes required by entities browser which do not exist yet
+    """
+    collection = odm.dispense(browser.model).collection
+
+    missing = get_missing(browser, owner_scoped)
+    for keys in missing:
+        collection.create_index(keys, background=True)
+        logger.info("Index {} created in collection '{}'".format(keys, collection.name))
+
+    return missing
+
+
+def _log_failure(model: str, future: Future):
+    e = future.exception()
+    if e:
+        logger.error("Cannot create indexes in collection of model '{}': {}".format(model, e), exc_info=e)
+
+
+def ensure(browser):
+    """Create missing indexes required by entities browser in background once per process
+
+    Indexes are created only if `odm_ui.auto_index` is enabled.
+    """
+    if not reg.get('odm_ui.auto_index', False):
+        return
+
+    # Set of used sorts only grows, so its size identifies advised indexes without computing them
+    owner_scoped = browser.is_owner_scoped()
+    keys = (browser.model, owner_scoped, len(_get_used_sorts(browser.model)))
+    if keys in _ensured:
+        return
+
+    with _lock:
+        if keys in _ensured:
+            return
+        _ensured.add(keys)
+
+    future = _executor.submit(create_missing, browser, owner_scoped)
+    future.add_done_callback(lambda f: _log_failure(browser.model, f))
+
+
+class Indexes(console.Command):
+    """Report or Create Indexes Required by Entities Browsers Command
+    """
+
+    def __init__(self):
+        super().__init__()
+
+        self.define_option(console.option.Bool('create'))
+        self.define_option(console.option.Bool('owner'))
+
+    @property
+    def name(self) -> str:
+        """Get name of the command
+        """
+        return 'odm_ui:indexes'
+
+    @property
+    def description(self) -> str:
+        """Get description of the command
+        """
+        return 'odm_ui@console_command_description_indexes'
+
+    @property
+    def signature(self) -> str:
+        """Get signature of the command
+        """
+        return '{} [model ...]'.format(super().signature)
+
+    def exec(self):
+        """Execute the command
+        """
+        from ._api import get_browser
+        from ._model import UIEntity
+
+        models = self.args or [m for m in odm.get_registered_models() if issubclass(odm.get_model_class(m), UIEntity)]
+
+        # Entities browser requires request context
+        router.set_request(http.Request(EnvironBuilder(path='/', base_url=router.base_url()).get_environ()))
+
+        auth.switch_user_to_system()
+        try:
+            for model in models:
+                browser = get_browser(model)
+                owner = self.opt('owner')
+                indexes = create_missing(browser, owner) if self.opt('create') else get_missing(browser, owner)
+                for keys in indexes:
+                    console.print_normal('{}: {}'.format(model, ', '.join('{} {}'.format(k, d) for k, d in keys)))
+
+                if not indexes:
+                    console.print_success('{}: all required indexes exist'.format(model))
+        finally:
+            auth.restore_user()
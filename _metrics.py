@@ -0,0 +1,217 @@
+"""PytSite Object Document Mapper UI Plugin Metrics
+"""
+__author__ = 'Oleksandr Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+import threading
+from typing import Dict, List, Optional, Tuple
+from collections import OrderedDict
+from contextlib import contextmanager
+from time import perf_counter
+from pymongo import monitoring
+from pytsite import reg, http, logger, mongodb
+
+_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_local = threading.local()
+_lock = threading.Lock()
+_histograms = {}  # type: Dict[Tuple[str, str], List]
+_counters = {}  # type: Dict[Tuple[str, str], int]
+
+
+class Scope:
+    """Database queries counter of a request, shared with pool threads working on its behalf
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queries = 0
+
+    @property
+    def queries(self) -> int:
+        return self._queries
+
+    def add_query(self):
+        with self._lock:
+            self._queries += 1
+
+
+class _QueryCounter(monitoring.CommandListener):
+    """Count database commands issued within the current thread's scope
+    """
+
+    def started(self, event: monitoring.CommandStartedEvent):
+        scope = getattr(_local, 'scope', None)
+        if scope:
+            scope.add_query()
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent):
+        pass
+
+    def failed(self, event: monitoring.CommandFailedEvent):
+        pass
+
+
+# Listener affects only database clients created after this point
+_query_counter = _QueryCounter()
+monitoring.register(_query_counter)
+_queries_counted = None  # type: Optional[bool]
+
+
+def queries_counted() -> bool:
+    """Check if database client was created after the queries counter was registered
+
+    Otherwise no queries are counted, so their numbers are not reported instead of being always zero.
+    """
+    global _queries_counted
+
+    if _queries_counted is None:
+        listeners = getattr(mongodb.get_client(), 'event_listeners', ())
+        _queries_counted = _query_counter in (listeners() if callable(listeners) else listeners)
+        if not _queries_counted:
+            logger.warn('Database client was created before odm_ui registered its queries counter, '
+                        'numbers of database queries will not be reported')
+
+    return _queries_counted
+
+
+def reset():
+    """Reset metrics collected by the current thread
+    """
+    _local.endpoint = None
+    _local.phases = OrderedDict()  # type: Dict[str, List]
+    _local.scope = Scope()
+
+
+def _init():
+    # Worker threads may already count queries within the scope of a request
+    if getattr(_local, 'phases', None) is None:
+        _local.endpoint = None
+        _local.phases = OrderedDict()  # type: Dict[str, List]
+    if getattr(_local, 'scope', None) is None:
+        _local.scope = Scope()
+
+
+def get_scope() -> Optional[Scope]:
+    """Get queries counting scope of the current thread
+    """
+    return getattr(_local, 'scope', None)
+
+
+def set_scope(scope: Optional[Scope]):
+    """Count queries issued by the current thread within a scope, i.e. of a request which submitted work to the pool
+    """
+    _local.scope = scope
+
+
+def set_endpoint(name: str):
+    """Set name of the endpoint which is processing current request
+    """
+    _init()
+    _local.endpoint = name
+
+
+@contextmanager
+def phase(name: str):
+    """Measure duration and number of database queries of a named phase
+
+    Multiple measurements of the same phase within a request are summed up.
+    """
+    _init()
+    queries = _local.scope.queries
+    start = perf_counter()
+
+    try:
+        yield
+    finally:
+        p = _local.phases.setdefault(name, [0.0, 0])
+        p[0] += perf_counter() - start
+        p[1] += _local.scope.queries - queries
+
+
+def server_timing() -> str:
+    """Get value for the Server-Timing header
+    """
+    phases = getattr(_local, 'phases', None)
+    if not phases:
+        return ''
+
+    if not queries_counted():
+        return ', '.join('{};dur={:.2f}'.format(name, p[0] * 1000) for name, p in phases.items())
+
+    r = ['{};dur={:.2f};desc="{} db"'.format(name, p[0] * 1000, p[1]) for name, p in phases.items()]
+    r.append('db;desc="{}"'.format(_local.scope.queries))
+
+    return ', '.join(r)
+
+
+def flush():
+    """Move metrics collected by the current thread to global histograms and counters
+    """
+    phases = getattr(_local, 'phases', None)
+    if not phases:
+        return
+
+    endpoint = _local.endpoint or 'other'
+    counted = queries_counted()
+
+    with _lock:
+        for name, (duration, queries) in phases.items():
+            key = (endpoint, name)
+
+            h = _histograms.get(key)
+            if not h:
+                h = _histograms[key] = [[0] * len(_BUCKETS), 0.0, 0]
+            for i, le in enumerate(_BUCKETS):
+                if duration <= le:
+                    h[0][i] += 1
+            h[1] += duration
+            h[2] += 1
+
+            if counted:
+                _counters[key] = _counters.get(key, 0) + queries
+
+    reset()
+
+
+def render() -> str:
+    """Render collected metrics in Prometheus text exposition format
+    """
+    lines = [
+        '# HELP odm_ui_phase_seconds Duration of odm_ui request processing phases.',
+        '# TYPE odm_ui_phase_seconds histogram',
+    ]
+
+    with _lock:
+        for (endpoint, name), (buckets, total, count) in sorted(_histograms.items()):
+            labels = 'endpoint="{}",phase="{}"'.format(endpoint, name)
+            for le, num in zip(_BUCKETS, buckets):
+                lines.append('odm_ui_phase_seconds_bucket{{{},le="{}"}} {}'.format(labels, le, num))
+            lines.append('odm_ui_phase_seconds_bucket{{{},le="+Inf"}} {}'.format(labels, count))
+            lines.append('odm_ui_phase_seconds_sum{{{}}} {}'.format(labels, total))
+            lines.append('odm_ui_phase_seconds_count{{{}}} {}'.format(labels, count))
+
+        lines.append('# HELP odm_ui_db_queries_total Database queries issued by odm_ui request processing phases.')
+        lines.append('# TYPE odm_ui_db_queries_total counter')
+        for (endpoint, name), num in sorted(_counters.items()):
+            lines.append('odm_ui_db_queries_total{{endpoint="{}",phase="{}"}} {}'.format(endpoint, name, num))
+
+    return '\n'.join(lines) + '\n'
+
+
+def on_pre_dispatch():
+    """pytsite.router@pre_dispatch event handler
+    """
+    reset()
+
+
+def on_response(response: http.Response):
+    """pytsite.router@response event handler
+    """
+    if reg.get('odm_ui.server_timing', reg.get('debug')):
+        header = server_timing()
+        if header:
+            response.headers.add('Server-Timing', header)
+
+    flush()
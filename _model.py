@@ -6,10 +6,9 @@ __license__ = 'MIT'
 
 from typing import Tuple, Dict, Type, List, Union, Optional
 from pytsite import router, lang, routing
-from plugins import widget, odm, odm_auth, form, admin
+from plugins import widget, odm, odm_auth, form, admin, auth
 from plugins.odm_auth import PERM_MODIFY, PERM_DELETE
-
-_ADM_BP = admin.base_path()
+from . import _field_widgets
 
 
 class UIEntity(odm_auth.OwnedEntity):
@@ -23,11 +22,104 @@ class UIEntity(odm_auth.OwnedEntity):
         ref = router.request().referrer
         ref_path = router.url(ref, add_lang_prefix=False, as_list=True)[2] if ref else ''
 
-        if path.startswith(_ADM_BP) or ref_path.startswith(_ADM_BP):
+        adm_bp = admin.base_path()
+        if path.startswith(adm_bp) or ref_path.startswith(adm_bp):
             rule_type = 'admin_' + rule_type
 
         return 'odm_ui@' + rule_type
 
+    @classmethod
+    def odm_ui_materialized_path_enabled(cls) -> bool:
+        """Should entity store list of its ancestors' references to make tree lookups single queries.
+        """
+        return False
+
+    def _setup_fields(self):
+        super()._setup_fields()
+
+        if self.odm_ui_materialized_path_enabled():
+            self.define_field(odm.field.List('_ancestors', allowed_types=(str,)))
+
+    def _setup_indexes(self):
+        super()._setup_indexes()
+
+        if self.odm_ui_materialized_path_enabled():
+            self.define_index([('_ancestors', odm.I_ASC)])
+
+    def _on_pre_save(self, **kwargs):
+        super()._on_pre_save(**kwargs)
+
+        if self.odm_ui_materialized_path_enabled():
+            parent = self.parent
+            ancestors = parent.f_get('_ancestors') + [parent.ref] if parent else []
+            self._odm_ui_ancestors_changed = ancestors != self.f_get('_ancestors')
+            self.f_set('_ancestors', ancestors)
+
+    def _on_after_save(self, first_save: bool = False, **kwargs):
+        super()._on_after_save(first_save, **kwargs)
+
+        # Entity has been moved, so its descendants must be updated too. Each child updates its own children.
+        if self.odm_ui_materialized_path_enabled() and not first_save and \
+                getattr(self, '_odm_ui_ancestors_changed', False):
+            self._odm_ui_ancestors_changed = False
+            auth.switch_user_to_system()
+            try:
+                for child in odm.find(self.model).eq('_parent', self).get():
+                    child.save()
+            finally:
+                auth.restore_user()
+
+    @classmethod
+    def odm_ui_materialized_path_rebuild(cls, model: str):
+        """Rebuild ancestors lists of all model's entities, i.e. after enabling materialized path on existing data.
+        """
+        auth.switch_user_to_system()
+        try:
+            level = list(odm.find(model).eq('_parent', None).get())
+            while level:
+                for entity in level:
+                    entity.save()
+                level = list(odm.find(model).inc('_parent', level).get())
+        finally:
+            auth.restore_user()
+
+    @property
+    def odm_ui_depth(self) -> int:
+        """Get depth of the entity in the tree.
+        """
+        if self.odm_ui_materialized_path_enabled():
+            return len(self.f_get('_ancestors'))
+
+        return self.depth
+
+    def odm_ui_ancestors(self) -> list:
+        """Get ancestors of the entity, starting from the root one.
+        """
+        if self.odm_ui_materialized_path_enabled():
+            refs = self.f_get('_ancestors')
+            if not refs:
+                return []
+
+            by_ref = {e.ref: e for e in odm.find(self.model).inc('_ref', refs).get()}
+
+            return [by_ref[ref] for ref in refs if ref in by_ref]
+
+        r = []
+        parent = self.parent
+        while parent:
+            r.insert(0, parent)
+            parent = parent.parent
+
+        return r
+
+    def odm_ui_descendants(self) -> list:
+        """Get all descendants of the entity.
+        """
+        if self.odm_ui_materialized_path_enabled():
+            return list(odm.find(self.model).eq('_ancestors', self.ref).get())
+
+        return list(self.descendants)
+
     @classmethod
     def odm_ui_browser_widget_class(cls) -> Type[widget.misc.DataTable]:
         return widget.misc.BootstrapTable
@@ -54,9 +146,18 @@ class UIEntity(odm_auth.OwnedEntity):
         """
         return ()
 
+    @classmethod
+    def odm_ui_browser_tree_mode(cls) -> bool:
+        """Should the entities browser load tree level by level instead of flat pages.
+        """
+        return False
+
     @classmethod
     def odm_ui_browser_mass_action_buttons(cls) -> Tuple[Dict, ...]:
         """Get toolbar mass actions buttons data.
+
+        Button with `query_enabled` flag is also applied to all entities matching browser's query, its form must
+        process entities by `MassAction.get_entities()`.
         """
         return ()
 
@@ -173,68 +274,13 @@ class UIEntity(odm_auth.OwnedEntity):
     def odm_ui_m_form_setup_widgets(self, frm: form.Form):
         """Hook
         """
-        weight = 0
-        for uid, field in self.fields.items():
-            if uid.startswith('_') or field is None:
-                continue
-
-            weight += 10
-
-            if isinstance(field, odm.field.Bool):
-                frm.add_widget(widget.select.Checkbox(
-                    uid=uid,
-                    weight=weight,
-                    label=self.t(uid),
-                    required=field.is_required,
-                    default=field.default,
-                    value=field.get_val(),
-                ))
-            elif isinstance(field, odm.field.Integer):
-                frm.add_widget(widget.input.Integer(
-                    uid=uid,
-                    weight=weight,
-                    label=self.t(uid),
-                    required=field.is_required,
-                    default=field.default,
-                    value=field.get_val(),
-                ))
-            elif isinstance(field, odm.field.Decimal):
-                frm.add_widget(widget.input.Decimal(
-                    uid=uid,
-                    weight=weight,
-                    label=self.t(uid),
-                    required=field.is_required,
-                    default=field.default,
-                    value=field.get_val(),
-                ))
-            elif isinstance(field, odm.field.Email):
-                frm.add_widget(widget.input.Email(
-                    uid=uid,
-                    weight=weight,
-                    label=self.t(uid),
-                    required=field.is_required,
-                    default=field.default,
-                    value=field.get_val(),
-                ))
-            elif isinstance(field, odm.field.String):
-                frm.add_widget(widget.input.Text(
-                    uid=uid,
-                    weight=weight,
-                    label=self.t(uid),
-                    required=field.is_required,
-                    default=field.default,
-                    value=field.get_val(),
-                ))
-            elif isinstance(field, odm.field.Enum):
-                frm.add_widget(widget.select.Select(
-                    uid=uid,
-                    weight=weight,
-                    label=self.t(uid),
-                    required=field.is_required,
-                    items=[(x, self.t(x)) for x in field.values],
-                    default=field.default,
-                    value=field.get_val(),
-                ))
+        for uid, widget_class, kwargs in _field_widgets.get_schema(self):
+            field = self.get_field(uid)
+            kwargs = dict(kwargs, uid=uid, label=self.t(uid), default=field.default, value=field.get_val())
+            if 'items' in kwargs:
+                kwargs['items'] = [(x, self.t(x)) for x in kwargs['items']]
+
+            frm.add_widget(widget_class(**kwargs))
 
     def odm_ui_m_form_validate(self, frm: form.Form):
         """Hook
@@ -249,8 +295,10 @@ class UIEntity(odm_auth.OwnedEntity):
             if self.has_field(f_name):
                 self.f_set(f_name, f_value)
 
-        # Save entity
-        self.save()
+        # Save entity, unless it reports no modification
+        if self.is_new or self.is_modified:
+            self.save()
+
         router.session().add_info_message(lang.t('odm_ui@operation_successful'))
 
     @classmethod
@@ -288,6 +336,14 @@ class UIEntity(odm_auth.OwnedEntity):
         """
         self.delete()
 
+    @classmethod
+    def odm_ui_d_form_submit_bulk(cls, entities: List['UIEntity']):
+        """Hook
+        """
+        # Entities are deleted one by one through odm, so their delete hooks perform cleanup as usual
+        for entity in entities:
+            entity.odm_ui_d_form_submit()
+
     @classmethod
     def odm_ui_view_rule(cls) -> str:
         """Get view router rule name
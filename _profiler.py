@@ -0,0 +1,109 @@
+"""PytSite Object Document Mapper UI Plugin Hooks Profiler
+"""
+__author__ = 'Oleksandr Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+import threading
+from typing import Callable, Dict, List, Tuple, Type
+from functools import wraps
+from inspect import getattr_static
+from time import perf_counter
+from pytsite import reg, logger
+
+_lock = threading.Lock()
+_local = threading.local()
+_instrumented = set()
+_stats = {}  # type: Dict[Tuple[str, str], List]
+
+
+def is_enabled() -> bool:
+    """Check if hooks profiling is enabled
+    """
+    return bool(reg.get('odm_ui.hook_profiling', False))
+
+
+def _record(model: str, hook: str, duration: float):
+    with _lock:
+        s = _stats.get((model, hook))
+        if not s:
+            s = _stats[(model, hook)] = [0, 0.0]
+        s[0] += 1
+        s[1] += duration
+
+    threshold = reg.get('odm_ui.hook_profiling_threshold', 50)
+    if duration * 1000 > threshold:
+        logger.warn("Hook {}() of model '{}' took {:.2f} ms, which is more than {} ms".
+                    format(hook, model, duration * 1000, threshold))
+
+
+def _wrap(model: str, hook: str, fn: Callable) -> Callable:
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        # Calls of overridden hooks through super() are accounted in the outermost call
+        active = getattr(_local, 'active', None)
+        if active is None:
+            active = _local.active = set()
+        if hook in active:
+            return fn(*args, **kwargs)
+
+        active.add(hook)
+        start = perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            active.discard(hook)
+            _record(model, hook, perf_counter() - start)
+
+    return wrapper
+
+
+def instrument(model: str, model_class: Type):
+    """Wrap all odm_ui_* hooks of a model class to collect calls statistics
+    """
+    if not is_enabled() or model in _instrumented:
+        return
+
+    with _lock:
+        if model in _instrumented:
+            return
+        _instrumented.add(model)
+
+    for name in dir(model_class):
+        if not name.startswith('odm_ui_'):
+            continue
+
+        attr = getattr_static(model_class, name)
+        if isinstance(attr, classmethod):
+            setattr(model_class, name, classmethod(_wrap(model, name, attr.__func__)))
+        elif isinstance(attr, staticmethod):
+            setattr(model_class, name, staticmethod(_wrap(model, name, attr.__func__)))
+        elif callable(attr):
+            setattr(model_class, name, _wrap(model, name, attr))
+
+
+def stats() -> Dict[Tuple[str, str], Tuple[int, float]]:
+    """Get number of calls and cumulative time in seconds per model and hook
+    """
+    with _lock:
+        return {k: (v[0], v[1]) for k, v in _stats.items()}
+
+
+def render() -> str:
+    """Render collected statistics in Prometheus text exposition format
+    """
+    lines = [
+        '# HELP odm_ui_hook_calls_total Number of odm_ui hooks calls.',
+        '# TYPE odm_ui_hook_calls_total counter',
+    ]
+
+    items = sorted(stats().items())
+    for (model, hook), (calls, _) in items:
+        lines.append('odm_ui_hook_calls_total{{model="{}",hook="{}"}} {}'.format(model, hook, calls))
+
+    lines.append('# HELP odm_ui_hook_seconds_total Cumulative time spent in odm_ui hooks.')
+    lines.append('# TYPE odm_ui_hook_seconds_total counter')
+    for (model, hook), (_, duration) in items:
+        lines.append('odm_ui_hook_seconds_total{{model="{}",hook="{}"}} {}'.format(model, hook, duration))
+
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,54 @@
+"""PytSite Object Document Mapper UI Plugin Concurrent Calls Coalescing
+"""
+__author__ = 'Oleksandr Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+import hashlib
+import json
+from typing import Any, Callable, Dict
+from concurrent.futures import Future
+from threading import Lock
+from pytsite import reg, lang
+from plugins import auth
+
+_lock = Lock()
+_in_flight = {}  # type: Dict[str, Future]
+
+
+def make_key(*parts) -> str:
+    """Build a key of a call, which is unique within current user's permission scope and language
+    """
+    return hashlib.md5(json.dumps([parts, auth.get_current_user().uid, lang.get_current()],
+                                  default=str, sort_keys=True).encode()).hexdigest()
+
+
+def do(key: str, fn: Callable[[], Any]) -> Any:
+    """Call a function, or wait for a result of an identical call which is already in progress
+
+    Result is shared among all callers, so it must not be modified by them.
+    """
+    if not reg.get('odm_ui.single_flight', True):
+        return fn()
+
+    with _lock:
+        future = _in_flight.get(key)
+        leader = future is None
+        if leader:
+            future = _in_flight[key] = Future()
+
+    if not leader:
+        return future.result()
+
+    # Followers must be released whatever happens to the leader, i.e. on KeyboardInterrupt or SystemExit too
+    try:
+        future.set_result(fn())
+    except BaseException as e:
+        future.set_exception(e)
+        if not isinstance(e, Exception):
+            raise
+    finally:
+        with _lock:
+            del _in_flight[key]
+
+    return future.result()
@@ -6,12 +6,10 @@ __license__ = 'MIT'
 
 import htmler
 from typing import List, Callable, Union, Iterable, Tuple
-from pyuca import Collator
 from json import dumps as json_dumps
-from pytsite import lang
+from pytsite import lang, reg
 from plugins import widget, odm, http_api, odm_http_api
-
-_pyuca_col = Collator()
+from . import _collation, _model
 
 
 def _sanitize_kwargs_exclude(kwargs: dict):
@@ -37,7 +35,9 @@ def _sanitize_kwargs_exclude(kwargs: dict):
 
     if kwargs.get('exclude_descendants', True):
         for ref in kwargs['exclude'].copy():
-            for descendant in odm.get_by_ref(ref).descendants:
+            entity = odm.get_by_ref(ref)
+            descendants = entity.odm_ui_descendants() if isinstance(entity, _model.UIEntity) else entity.descendants
+            for descendant in descendants:
                 kwargs['exclude'].append(descendant.ref)
 
 
@@ -158,8 +158,8 @@ class EntitySelect(widget.select.Select2):
                 for ref in self._value if self._multiple else [self._value]:
                     entity = odm.get_by_ref(ref)
                     title = entity.odm_ui_widget_select_search_entities_title(self._entity_title_args)
-                    if entity.depth:
-                        title = '{} {}'.format(self._depth_indent * entity.depth, title)
+                    if entity.odm_ui_depth:
+                        title = '{} {}'.format(self._depth_indent * entity.odm_ui_depth, title)
                     self._items.append([entity.ref, title])
             except odm.error.InvalidReference as e:
                 if not self._ignore_invalid_refs:
@@ -290,8 +290,7 @@ class EntityCheckboxes(widget.select.Checkboxes):
 
         # Do additional sorting of string fields, because MongoDB does not sort properly all languages
         if self._sort_field and isinstance(odm.dispense(self._model).get_field(self._sort_field), odm.field.String):
-            rev = True if self._sort_order == odm.I_DESC else False
-            entities = sorted(entities, key=lambda ent: _pyuca_col.sort_key(ent.f_get(self._sort_field)), reverse=rev)
+            entities = _collation.sort_entities(entities, self._sort_field, self._sort_order)
 
         return entities
 
@@ -475,6 +474,7 @@ class EntitySlots(widget.Abstract):
 
     def _get_element(self, **kwargs) -> htmler.Element:
         self.data.update({
+            'batch_size': reg.get('odm_ui.entities_batch_size', 100),
             'enabled': self._enabled,
             'empty_slot_title': self._empty_slot_title,
             'entity_thumb_field': self._entity_thumb_field,
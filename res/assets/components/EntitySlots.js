@@ -6,10 +6,13 @@ import setupWidget from '@pytsite/widget';
 import {Slots, TwoButtonsModal, Select2} from '@pytsite/widget/components';
 import {lang} from '@pytsite/assetman';
 import httpApi from '@pytsite/http-api';
-import odmHttpApi from '@pytsite/odm-http-api';
+
+// Projected entities shared between all widgets on the page, keyed by model, fields and reference
+const entitiesCache = {};
 
 export default class EntitySlots extends React.Component {
     static propTypes = {
+        batchSize: PropTypes.number,
         emptySlotTitle: PropTypes.string,
         emptySlotRenderer: PropTypes.func,
         enabled: PropTypes.bool,
@@ -32,6 +35,7 @@ export default class EntitySlots extends React.Component {
     };
 
     static defaultProps = {
+        batchSize: 100,
         entityTitleField: 'title',
         entityThumbField: 'thumbnail',
         entityUrlField: 'url',
@@ -58,14 +62,60 @@ export default class EntitySlots extends React.Component {
         this.onSlotBtnDeleteClick = this.onSlotBtnDeleteClick.bind(this);
     }
 
+    fields() {
+        const fields = [
+            this.props.entityTitleField,
+            this.props.entityUrlField,
+            this.props.entityThumbField,
+        ];
+
+        // Needed to merge sorted batches
+        if (this.props.sortBy && fields.indexOf(this.props.sortBy) < 0)
+            fields.push(this.props.sortBy);
+
+        return fields;
+    }
+
+    cacheKey(ref) {
+        return JSON.stringify([this.props.model, this.fields(), ref]);
+    }
+
+    fetchEntities(refs, sortBy = null, sortOrder = 1) {
+        // Server returns limited number of entities per request
+        const batches = [];
+        for (let i = 0; i < refs.length; i += this.props.batchSize)
+            batches.push(refs.slice(i, i + this.props.batchSize));
+
+        return Promise.all(batches.map(batch => httpApi.get(`odm_ui/entities/${this.props.model}`, {
+            refs: JSON.stringify(batch),
+            fields: JSON.stringify(this.fields()),
+            sort_by: sortBy,
+            sort_order: sortOrder,
+        }))).then(results => {
+            const data = [].concat(...results);
+
+            // Each batch is sorted by server separately
+            if (sortBy && results.length > 1) {
+                data.sort((a, b) => {
+                    const [x, y] = [a[sortBy], b[sortBy]];
+                    const numeric = typeof x === 'number' && typeof y === 'number';
+                    const r = numeric ? x - y : String(x).localeCompare(String(y));
+
+                    return sortOrder === -1 ? -r : r;
+                });
+            }
+
+            data.forEach(entity => entitiesCache[this.cacheKey(entity.ref)] = entity);
+
+            return data;
+        });
+    }
+
     componentDidMount() {
-        const urlArgs = {
-            refs: JSON.stringify(this.props.value),
-            sort_by: this.props.sortBy,
-            sort_order: this.props.sortOrder,
-        };
+        if (!this.props.value.length)
+            return;
 
-        odmHttpApi.getAllEntities(this.props.model, urlArgs).then(data => {
+        this.fetchEntities(this.props.value, this.props.sortBy, this.props.sortOrder).then(data => {
             const entities = {};
 
             data.map(entity => entities[entity.ref] = entity);
@@ -84,9 +134,13 @@ export default class EntitySlots extends React.Component {
         if (!this.state.selectedEntityRef)
             return;
 
-        httpApi.get(`odm/entity/${this.state.selectedEntityRef}`).then(entity => {
+        const ref = this.state.selectedEntityRef;
+        const entity = entitiesCache[this.cacheKey(ref)];
+        const entityPromise = entity ? Promise.resolve([entity]) : this.fetchEntities([ref]);
+
+        entityPromise.then(data => {
             const entities = this.state.entities;
-            entities[entity.ref] = entity;
+            data.forEach(entity => entities[entity.ref] = entity);
             this.setState({entities: entities})
         });
 
@@ -200,7 +254,8 @@ export default class EntitySlots extends React.Component {
 }
 
 setupWidget('plugins.odm_ui._widget.EntitySlots', widget => {
-    const c = <EntitySlots emptySlotTitle={widget.data('emptySlotTitle')}
+    const c = <EntitySlots batchSize={widget.data('batchSize')}
+                           emptySlotTitle={widget.data('emptySlotTitle')}
                            enabled={widget.data('enabled') === 'True'}
                            entityTitleField={widget.data('entityTitleField')}
                            entityThumbField={widget.data('entityThumbField')}
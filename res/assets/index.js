@@ -20,3 +20,379 @@ $('.odm-ui-m-form').on('forward:form:pytsite', function () {
         }
     }, 1000)
 });
+
+$('.odm-ui-browser[data-delta-url]').each(function () {
+    const form = $(this);
+    const table = form.find('table').first();
+    const deltaUrl = form.data('deltaUrl');
+    let syncToken = null;
+
+    table.on('load-success.bs.table', (e, data) => {
+        if (data && data.sync_token !== undefined)
+            syncToken = data.sync_token;
+    });
+
+    function rowIndex(rows, id) {
+        for (let i = 0; i < rows.length; i++) {
+            if (rows[i].__id === id)
+                return i;
+        }
+
+        return -1;
+    }
+
+    function pullDelta() {
+        if (syncToken === null)
+            return;
+
+        const opts = table.bootstrapTable('getOptions');
+
+        $.getJSON(deltaUrl, {
+            since: syncToken,
+            search: opts.searchText,
+            sort: opts.sortName,
+            order: opts.sortOrder,
+        }).done(delta => {
+            syncToken = delta.token;
+
+            const rows = table.bootstrapTable('getData');
+
+            // Position of new rows is known only to the server
+            if (delta.reset || delta.inserted.length) {
+                table.bootstrapTable('refresh', {silent: true});
+                return;
+            }
+
+            // Changed rows which are not on the current page are skipped
+            delta.rows.forEach(row => {
+                const index = rowIndex(rows, row.__id);
+                if (index >= 0)
+                    table.bootstrapTable('updateRow', {index: index, row: row});
+            });
+
+            if (delta.removed.length)
+                table.bootstrapTable('remove', {field: '__id', values: delta.removed});
+        });
+    }
+
+    // Server pushes notifications about changed rows
+    if (form.data('eventsUrl') && window.EventSource) {
+        let timeout = null;
+
+        new EventSource(form.data('eventsUrl')).onmessage = () => {
+            // Coalesce bursts of changes into a single request
+            clearTimeout(timeout);
+            timeout = setTimeout(pullDelta, 500);
+        };
+    }
+
+    // Polling
+    const interval = parseInt(form.data('deltaInterval'));
+    if (interval) {
+        setInterval(() => {
+            if (!document.hidden)
+                pullDelta();
+        }, interval * 1000);
+    }
+});
+
+// Tree mode: children of a row are loaded on demand and inserted below it
+$('.odm-ui-browser[data-children-url]').each(function () {
+    const form = $(this);
+    const table = form.find('table').first();
+    const childrenUrl = form.data('childrenUrl');
+    let expanded = {};  // Row ID -> IDs of loaded children
+    let depths = {};  // Row ID -> depth
+
+    function rowIndex(rows, id) {
+        for (let i = 0; i < rows.length; i++) {
+            if (rows[i].__id === id)
+                return i;
+        }
+
+        return -1;
+    }
+
+    function descendants(id) {
+        const r = [];
+        (expanded[id] || []).forEach(childId => r.push(childId, ...descendants(childId)));
+
+        return r;
+    }
+
+    function treeCellIndex() {
+        let r = -1;
+
+        table.find('thead th[data-field]').each(function (i) {
+            const field = $(this).data('field');
+            if (r < 0 && field !== 'state' && field !== 'entity-actions' && field.indexOf('__') !== 0)
+                r = $(this).index();
+        });
+
+        return r;
+    }
+
+    function decorate() {
+        const rows = table.bootstrapTable('getData');
+        const cellIndex = treeCellIndex();
+        if (cellIndex < 0)
+            return;
+
+        table.find('tbody > tr[data-index]').each(function () {
+            const row = rows[$(this).data('index')];
+            const cell = $(this).children('td').eq(cellIndex);
+            if (!row || cell.find('.odm-ui-browser-tree-toggle').length)
+                return;
+
+            const indent = $('<span class="odm-ui-browser-tree-indent"></span>').css({
+                display: 'inline-block',
+                width: (depths[row.__id] || 0) * 1.5 + 'em',
+            });
+
+            let toggle = $('<span class="odm-ui-browser-tree-toggle fa fas fa-fw"></span>');
+            if (row.__children) {
+                toggle = $('<a href="#" class="odm-ui-browser-tree-toggle fa fas fa-fw"></a>').data('id', row.__id);
+                toggle.addClass(expanded[row.__id] ? 'fa-caret-down' : 'fa-caret-right');
+            }
+
+            cell.prepend(toggle).prepend(indent);
+        });
+    }
+
+    function redecorate() {
+        table.find('.odm-ui-browser-tree-indent, .odm-ui-browser-tree-toggle').remove();
+        decorate();
+    }
+
+    function collapse(id) {
+        const ids = descendants(id);
+        ids.forEach(i => delete expanded[i]);
+        delete expanded[id];
+
+        if (ids.length)
+            table.bootstrapTable('remove', {field: '__id', values: ids});
+        else
+            redecorate();
+    }
+
+    function expand(id) {
+        const row = table.bootstrapTable('getData')[rowIndex(table.bootstrapTable('getData'), id)];
+        const opts = table.bootstrapTable('getOptions');
+
+        $.getJSON(childrenUrl.replace('__PARENT__', encodeURIComponent(id)), {
+            offset: 0,
+            limit: row.__children,
+            sort: opts.sortName,
+            order: opts.sortOrder,
+        }).done(data => {
+            let index = rowIndex(table.bootstrapTable('getData'), id);
+            if (index < 0)
+                return;
+
+            expanded[id] = data.rows.map(child => child.__id);
+            if (!data.rows.length)
+                redecorate();
+
+            data.rows.forEach(child => {
+                depths[child.__id] = (depths[id] || 0) + 1;
+                table.bootstrapTable('insertRow', {index: ++index, row: child});
+            });
+        });
+    }
+
+    table.on('load-success.bs.table', () => {
+        expanded = {};
+        depths = {};
+    });
+
+    table.on('post-body.bs.table', decorate);
+
+    table.on('click', '.odm-ui-browser-tree-toggle', function (e) {
+        e.preventDefault();
+
+        const id = $(this).data('id');
+        if (!id)
+            return;
+
+        if (expanded[id])
+            collapse(id);
+        else
+            expand(id);
+    });
+});
+
+// Mass actions may be applied to all entities matching browser's query, not only to rows checked on the page
+$('.odm-ui-browser').each(function () {
+    const form = $(this);
+    const table = form.find('table').first();
+    const button = form.find('.select-all-matching-button');
+    let matching = false;
+
+    if (!button.length)
+        return;
+
+    function setMatching(value) {
+        matching = value;
+        button.toggleClass('active', matching);
+        form.find('.mass-action-button:not([data-query-enabled])').toggleClass('disabled', matching);
+    }
+
+    function reset() {
+        setMatching(false);
+        button.addClass('hidden');
+    }
+
+    table.on('check-all.bs.table', () => {
+        const opts = table.bootstrapTable('getOptions');
+        if (opts.totalRows > table.bootstrapTable('getData').length)
+            button.removeClass('hidden');
+    });
+
+    table.on('uncheck.bs.table uncheck-all.bs.table load-success.bs.table', reset);
+
+    button.on('click', e => {
+        e.preventDefault();
+        setMatching(!matching);
+    });
+
+    // Capturing listener runs before handlers which add IDs of checked rows to the URL
+    form[0].addEventListener('click', e => {
+        const link = $(e.target).closest('.mass-action-button');
+        if (!matching || !link.length)
+            return;
+
+        e.preventDefault();
+        e.stopPropagation();
+
+        if (!link.is('[data-query-enabled]'))
+            return;
+
+        const opts = table.bootstrapTable('getOptions');
+        const query = JSON.stringify({search: opts.searchText, sort: opts.sortName, order: opts.sortOrder});
+        const href = link.attr('href');
+
+        window.location.href = href + (href.indexOf('?') < 0 ? '?' : '&') +
+            $.param({query: query, __redirect: window.location.href});
+    }, true);
+});
+
+// Let server skip counting browser rows, if neither entities nor filters were changed since previous request
+const countTokens = {};
+
+$(document).ajaxSuccess((e, xhr, settings) => {
+    const data = xhr.responseJSON;
+    if (data && data.count_token)
+        countTokens[settings.url.split('?')[0]] = {total: data.total, count_token: data.count_token};
+});
+
+$.ajaxPrefilter(options => {
+    const countToken = countTokens[options.url.split('?')[0]];
+    if (countToken && options.type.toUpperCase() === 'GET')
+        options.url += (options.url.indexOf('?') < 0 ? '?' : '&') + $.param(countToken);
+});
+
+// Server aborted too slow query
+$('.odm-ui-browser table').on('post-body.bs.table', function (e, data) {
+    const response = $(this).data('odmUiResponse');
+    if (response && response.timeout)
+        $(this).find('.no-records-found td').text(response.message);
+}).on('load-success.bs.table', function (e, data) {
+    $(this).data('odmUiResponse', data);
+});
+
+// Expand rows sent in columnar format
+function escapeHtml(s) {
+    return String(s).replace(/[&<>"']/g, c => ({'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;'})[c]);
+}
+
+function renderAction(action, id) {
+    const url = action.url.split('__ID__').join(id);
+    const css = action.css + (action.disabled ? ' disabled' : '');
+    const disabled = action.disabled ? ' aria-disabled="true"' : '';
+
+    return `<a href="${escapeHtml(url)}" class="${escapeHtml(css)}" title="${escapeHtml(action.title)}" ` +
+        `role="button"${disabled}><i class="${escapeHtml(action.icon)}"></i></a>`;
+}
+
+function expandRows(data) {
+    if (!data || data.format !== 'compact')
+        return data;
+
+    data.rows = data.rows.map(values => {
+        const row = {};
+        data.columns.forEach((column, i) => row[column] = values[i]);
+
+        if (Array.isArray(row['entity-actions']))
+            row['entity-actions'] = row['entity-actions'].map(i => renderAction(data.actions[i], row.__id)).join('&nbsp;');
+
+        return row;
+    });
+
+    delete data.columns;
+    delete data.actions;
+
+    return data;
+}
+
+$.ajaxPrefilter(options => {
+    if (/[?&]format=compact(&|$)/.test(options.url))
+        options.converters = $.extend({}, options.converters, {'text json': text => expandRows(JSON.parse(text))});
+});
+
+// Serve the first page of rows embedded by server instead of requesting it
+const firstPages = [];
+
+$('.odm-ui-browser[data-first-page]').each(function () {
+    firstPages.push($(this).data('firstPage'));
+});
+
+function queryArgs(url) {
+    const r = {};
+    const query = url.split('?')[1] || '';
+
+    query.split('&').filter(p => p).forEach(p => {
+        const [k, v] = p.split('=');
+        r[decodeURIComponent(k)] = decodeURIComponent((v || '').replace(/\+/g, ' '));
+    });
+
+    return r;
+}
+
+function urlPath(url) {
+    return new URL(url, window.location.href).pathname;
+}
+
+function takeFirstPage(url) {
+    const args = queryArgs(url);
+    if (args.search)
+        return null;
+
+    for (let i = 0; i < firstPages.length; i++) {
+        const page = firstPages[i];
+        const matches = Object.keys(page.args).every(k => {
+            const v = page.args[k];
+            return args[k] === undefined ? k === 'sort' || k === 'order' : String(v) === args[k];
+        });
+
+        if (matches && urlPath(page.url) === urlPath(url)) {
+            firstPages.splice(i, 1);
+            return page.response;
+        }
+    }
+
+    return null;
+}
+
+$.ajaxTransport('+json', options => {
+    if (!firstPages.length || options.type.toUpperCase() !== 'GET')
+        return;
+
+    const response = takeFirstPage(options.url);
+    if (!response)
+        return;
+
+    return {
+        send: (headers, complete) => complete(200, 'success', {text: JSON.stringify(response)}),
+        abort: () => null,
+    };
+});
@@ -0,0 +1,29 @@
+"""PytSite Object Document Mapper UI Plugin Index Advisor Tests
+"""
+__author__ = 'Oleksandr Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+import pytest
+
+pytest.importorskip('pytsite')
+
+from plugins.odm_ui import _indexes
+
+
+def test_index_keys_stop_at_text_key():
+    info = {'key': [('author', 1), ('_fts', 'text'), ('_ftsx', 1)]}
+
+    assert _indexes._index_keys(info) == [('author', 1)]
+
+
+def test_text_index_does_not_cover_sort():
+    existing = [_indexes._index_keys(info) for info in (
+        {'key': [('_id', 1)]},
+        {'key': [('_fts', 'text'), ('_ftsx', 1)]},
+        {'key': [('location', '2dsphere')]},
+        {'key': [('_parent', 1), ('title', -1.0)]},
+    )]
+
+    assert not any(_indexes._covers(e, [('_parent', 1), ('created', 1)]) for e in existing)
+    assert any(_indexes._covers(e, [('_parent', -1), ('title', 1)]) for e in existing)